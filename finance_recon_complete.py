@@ -1,17 +1,33 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 from PIL import Image
 import os
 from datetime import datetime, timedelta
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from io import BytesIO
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import threading
 import time
 import calendar
+import re
+import random
+import asyncio
+import hashlib
+import tempfile
+import sqlite3
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import logging
+from multiprocessing import shared_memory
 from PyPDF2 import PdfReader, PdfWriter
+from page_scan import extract_page_range, extract_text_safe, scan_context
 
 # Try to import Supabase
 try:
@@ -20,6 +36,15 @@ try:
 except ImportError:
     SUPABASE_AVAILABLE = False
 
+# Optional: streaming JSON parser for large Azure results
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
 # --- PAGE CONFIG ---
 st.set_page_config(page_title="D.E.V.I.N - Finance Advisor", layout="wide", page_icon="💼")
 
@@ -202,7 +227,35 @@ USE_DATABASE = supabase is not None
 # --- CONSTANTS ---
 AZURE_ENDPOINT = st.secrets.get("AZURE_ENDPOINT", "")
 AZURE_KEY = st.secrets.get("AZURE_KEY", "")
+PARALLEL_SCAN_MIN_PAGES = int(st.secrets.get("PARALLEL_SCAN_MIN_PAGES", 30))  # Smaller PDFs are scanned in-process
+PAGE_SCAN_CACHE_SIZE = 128  # PDFs whose page classification is remembered
+SCAN_MAX_PROCESSES = int(st.secrets.get("SCAN_MAX_PROCESSES", os.cpu_count() or 1))
+AZURE_MODEL_ID = "prebuilt-invoice"
+AZURE_API_VERSION = "2023-07-31"
+AZURE_POLL_INITIAL = 0.25  # First wait between polls (seconds)
+AZURE_POLL_MAX = 4.0  # Backoff ceiling between polls (seconds)
+AZURE_TIMEOUT_BASE = 120  # Deadline for any document (seconds)
+AZURE_TIMEOUT_PER_PAGE = 5  # Extra deadline per page (seconds)
+AZURE_POOL_SIZE = int(st.secrets.get("AZURE_POOL_SIZE", 10))  # Keep-alive connections to Azure
+AZURE_MAX_RETRIES = int(st.secrets.get("AZURE_MAX_RETRIES", 3))  # Retries of a refused submission or a dropped connection
+AZURE_SUBMIT_RETRY_STATUSES = (429, 503)  # Azure refused the document, so resubmitting can't double-bill
+AZURE_TRANSIENT_STATUSES = (429, 500, 502, 503, 504)  # Poll responses that mean "try again later"
+AZURE_CACHE_DIR = st.secrets.get("AZURE_CACHE_DIR", ".azure_cache")
+AZURE_CACHE_MAX_MB = int(st.secrets.get("AZURE_CACHE_MAX_MB", 200))
+AZURE_CACHE_TTL_DAYS = int(st.secrets.get("AZURE_CACHE_TTL_DAYS", 30))
 MASTER_PASSWORD = "922626"
+TRANSACTION_INSERT_CHUNK = int(st.secrets.get("TRANSACTION_INSERT_CHUNK", 500))  # Rows per bulk insert
+TRANSACTION_COLUMNS = "id,date,vendor,amount,category,type,notes,card_name,updated_at"
+TRANSACTION_SYNC_COLUMN = "updated_at"  # High-water mark for incremental sync
+TRANSACTION_PAGE_SIZE = 1000  # Rows per page when loading history
+HISTORY_WINDOWS = {"Last 3 months": 3, "Last 12 months": 12, "All time": None}
+DATA_CACHE_TTL = int(st.secrets.get("DATA_CACHE_TTL", 300))  # Seconds before cached loads are refetched
+INGEST_MAX_WORKERS = int(st.secrets.get("INGEST_MAX_WORKERS", 4))  # Statements analyzed in parallel
+JOB_DIR = st.secrets.get("JOB_DIR", ".jobs")  # Job database and uploaded PDFs awaiting analysis
+JOB_POLL_INTERVAL = 1.0  # Seconds between status checks while jobs run
+JOB_RETENTION_DAYS = 7
+CATEGORY_RULES_FILE = st.secrets.get("CATEGORY_RULES_FILE", "category_rules.json")  # Optional, see README
+CATEGORY_MEMO_SIZE = 50000  # Normalized merchants remembered per process
 
 # --- SESSION STATE INIT ---
 if 'authenticated' not in st.session_state:
@@ -227,6 +280,8 @@ if 'onboarding_data' not in st.session_state:
     }
 if 'all_user_data' not in st.session_state:
     st.session_state.all_user_data = {}
+if 'data_cache' not in st.session_state:
+    st.session_state.data_cache = {}  # user_id -> cached loads, see _user_cache
 
 # --- LOGO FUNCTION ---
 def render_devin_logo(size="large"):
@@ -265,99 +320,907 @@ def render_devin_logo(size="large"):
         </div>
         """, unsafe_allow_html=True)
 
+# --- TRANSACTION STORE ---
+class TransactionStore:
+    """
+    Columnar storage for transactions: datetime64[s] dates, int64 cents and int32
+    categorical codes for the text columns. Rows are appended into
+    preallocated arrays, and masks and group-bys run on whole columns.
+    Rows may carry a key (the database id) so they can be upserted or removed.
+    Iterating yields the usual transaction dicts for row-at-a-time code.
+    """
+    TEXT_COLUMNS = ('Vendor', 'Category', 'Type', 'Notes', 'Card')
+    COLUMNS = ('Date', 'Vendor', 'Amount', 'Category', 'Type', 'Notes', 'Card')
+    
+    def __init__(self, capacity=64):
+        self._size = 0
+        self._dates = np.empty(capacity, dtype='datetime64[s]')
+        self._cents = np.empty(capacity, dtype=np.int64)
+        self._codes = {col: np.empty(capacity, dtype=np.int32) for col in self.TEXT_COLUMNS}
+        self._levels = {col: [] for col in self.TEXT_COLUMNS}
+        self._level_codes = {col: {} for col in self.TEXT_COLUMNS}
+        self._keys = []
+        self._key_rows = {}
+    
+    @classmethod
+    def from_records(cls, records, keys=None):
+        records = list(records)
+        store = cls(max(64, len(records)))
+        store.append(records, keys)
+        return store
+    
+    def __len__(self):
+        return self._size
+    
+    def __iter__(self):
+        return iter(self.records())
+    
+    # Column views (no copies)
+    @property
+    def dates(self):
+        return self._dates[:self._size]
+    
+    @property
+    def cents(self):
+        return self._cents[:self._size]
+    
+    @property
+    def amounts(self):
+        return self.cents / 100
+    
+    def codes(self, column):
+        return self._codes[column][:self._size]
+    
+    def levels(self, column):
+        return self._levels[column]
+    
+    # Writes
+    def _grow(self, needed):
+        capacity = len(self._cents)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        
+        def grown(array):
+            new_array = np.empty(capacity, dtype=array.dtype)
+            new_array[:self._size] = array[:self._size]
+            return new_array
+        
+        self._dates = grown(self._dates)
+        self._cents = grown(self._cents)
+        self._codes = {col: grown(codes) for col, codes in self._codes.items()}
+    
+    def _encode(self, column, values):
+        level_codes = self._level_codes[column]
+        levels = self._levels[column]
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            value = "" if value is None else str(value)
+            code = level_codes.get(value)
+            if code is None:
+                code = level_codes[value] = len(levels)
+                levels.append(value)
+            codes[i] = code
+        return codes
+    
+    def _positions_for(self, count, keys):
+        """Row positions for incoming rows: existing keys are overwritten, the rest appended"""
+        if keys is None:
+            self._keys.extend([None] * count)
+            return np.arange(self._size, self._size + count)
+        
+        positions = np.empty(count, dtype=np.int64)
+        for i, key in enumerate(keys):
+            row = self._key_rows.get(key)
+            if row is None:
+                row = self._key_rows[key] = len(self._keys)
+                self._keys.append(key)
+            positions[i] = row
+        return positions
+    
+    def append(self, records, keys=None):
+        """Add transaction dicts; rows whose key already exists are replaced (upsert)"""
+        records = list(records)
+        if not records:
+            return
+        positions = self._positions_for(len(records), keys)
+        self._grow(len(self._keys))
+        
+        self._dates[positions] = pd.to_datetime(
+            [r['Date'] for r in records], format="%Y-%m-%d", errors='coerce'
+        ).values.astype('datetime64[s]')
+        # Unparseable amounts are stored as 0 rather than rejecting the whole batch
+        amounts = pd.to_numeric(pd.Series([r['Amount'] for r in records], dtype=object), errors='coerce').fillna(0)
+        self._cents[positions] = np.rint(amounts.to_numpy(dtype=np.float64) * 100).astype(np.int64)
+        for col in self.TEXT_COLUMNS:
+            self._codes[col][positions] = self._encode(col, [r.get(col) for r in records])
+        self._size = len(self._keys)
+    
+    def append_store(self, other, keys=None):
+        """Append every row of another store, remapping its category codes in bulk"""
+        if not len(other):
+            return
+        positions = self._positions_for(len(other), keys)
+        self._grow(len(self._keys))
+        
+        self._dates[positions] = other.dates
+        self._cents[positions] = other.cents
+        for col in self.TEXT_COLUMNS:
+            remap = self._encode(col, other.levels(col))
+            self._codes[col][positions] = remap[other.codes(col)]
+        self._size = len(self._keys)
+    
+    def remove(self, keys):
+        """Drop the rows with the given keys"""
+        rows = [self._key_rows[key] for key in keys if key in self._key_rows]
+        if not rows:
+            return
+        keep = np.ones(self._size, dtype=bool)
+        keep[rows] = False
+        index = np.flatnonzero(keep)
+        
+        self._dates[:len(index)] = self.dates[index]
+        self._cents[:len(index)] = self.cents[index]
+        for col in self.TEXT_COLUMNS:
+            self._codes[col][:len(index)] = self.codes(col)[index]
+        self._keys = [self._keys[i] for i in index]
+        self._key_rows = {key: row for row, key in enumerate(self._keys) if key is not None}
+        self._size = len(index)
+    
+    # Reads
+    def mask(self, transaction_type=None, category=None, start=None, end=None):
+        """Boolean row mask; start/end are inclusive "YYYY-MM-DD" dates"""
+        mask = np.ones(self._size, dtype=bool)
+        for col, value in (('Type', transaction_type), ('Category', category)):
+            if value is not None:
+                mask &= self.codes(col) == self._level_codes[col].get(value, -1)
+        if start is not None:
+            mask &= self.dates >= np.datetime64(start, 'D')
+        if end is not None:
+            mask &= self.dates <= np.datetime64(end, 'D')
+        return mask
+    
+    def select(self, index):
+        """New store holding the rows picked by a boolean mask or position array"""
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        
+        store = TransactionStore(max(64, len(index)))
+        store._size = len(index)
+        store._dates[:len(index)] = self.dates[index]
+        store._cents[:len(index)] = self.cents[index]
+        for col in self.TEXT_COLUMNS:
+            store._codes[col][:len(index)] = self.codes(col)[index]
+            store._levels[col] = list(self._levels[col])
+            store._level_codes[col] = dict(self._level_codes[col])
+        store._keys = [self._keys[i] for i in index]
+        store._key_rows = {key: row for row, key in enumerate(store._keys) if key is not None}
+        return store
+    
+    def sorted_by_date(self, descending=True):
+        """Rows ordered by date; rows without a date always come last"""
+        undated = np.isnat(self.dates)
+        dated = np.flatnonzero(~undated)
+        order = dated[np.argsort(self.dates[dated], kind='stable')]
+        if descending:
+            order = order[::-1]
+        return self.select(np.concatenate([order, np.flatnonzero(undated)]))
+    
+    def total(self, mask=None):
+        cents = self.cents if mask is None else self.cents[mask]
+        return int(cents.sum()) / 100
+    
+    def sum_by(self, column, mask=None):
+        """Returns: {level: amount} for levels present in the (masked) rows"""
+        codes, cents = self.codes(column), self.cents
+        if mask is not None:
+            codes, cents = codes[mask], cents[mask]
+        levels = self._levels[column]
+        counts = np.bincount(codes, minlength=len(levels))
+        totals = np.bincount(codes, weights=cents, minlength=len(levels))
+        return {levels[code]: totals[code] / 100 for code in np.flatnonzero(counts)}
+    
+    def to_frame(self):
+        """
+        pandas view of the store. Dates are shared, not copied; text columns come
+        back as Categoricals over the store's levels (pandas picks its own code width).
+        """
+        data = {'Date': self.dates, 'Amount': self.amounts}
+        for col in self.TEXT_COLUMNS:
+            data[col] = pd.Categorical.from_codes(self.codes(col), categories=pd.Index(self._levels[col], dtype=object))
+        return pd.DataFrame(data, columns=list(self.COLUMNS), copy=False)
+    
+    def records(self):
+        dates = [None if date == 'NaT' else date for date in np.datetime_as_string(self.dates, unit='D').tolist()]
+        amounts = self.amounts.tolist()
+        text = {col: [self._levels[col][code] for code in self.codes(col).tolist()] for col in self.TEXT_COLUMNS}
+        return [
+            {'Date': dates[i], 'Vendor': text['Vendor'][i], 'Amount': amounts[i], 'Category': text['Category'][i],
+             'Type': text['Type'][i], 'Notes': text['Notes'][i], 'Card': text['Card'][i]}
+            for i in range(self._size)
+        ]
+
+# --- MONTHLY ROLLUP ---
+class MonthlyRollup:
+    """
+    Per-user totals keyed by (month "YYYY-MM", category, type) -> [cents, count].
+    Updated as transactions are saved, so dashboard aggregates read a few
+    cells instead of rescanning raw rows. Local equivalent of the
+    transaction_rollups table (see README).
+    """
+    
+    def __init__(self):
+        self._cells = {}
+    
+    @classmethod
+    def from_store(cls, store):
+        """Roll up a TransactionStore in one group-by (rows without a date are skipped)"""
+        rollup = cls()
+        valid = ~np.isnat(store.dates)
+        if not valid.any():
+            return rollup
+        
+        frame = pd.DataFrame({
+            'month': store.dates[valid].astype('datetime64[M]').astype(np.int64),
+            'category': store.codes('Category')[valid],
+            'type': store.codes('Type')[valid],
+            'cents': store.cents[valid]
+        })
+        grouped = frame.groupby(['month', 'category', 'type'], sort=False)['cents'].agg(['sum', 'count'])
+        categories, types = store.levels('Category'), store.levels('Type')
+        for (month, category, kind), cents, count in zip(grouped.index, grouped['sum'].tolist(), grouped['count'].tolist()):
+            rollup._cells[(str(np.datetime64(month, 'M')), categories[category], types[kind])] = [cents, count]
+        return rollup
+    
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from transaction_rollups rows"""
+        rollup = cls()
+        for row in rows:
+            rollup._cells[(row['month'], row['category'], row['type'])] = [
+                int(round(float(row['total']) * 100)), int(row['count'])
+            ]
+        return rollup
+    
+    def add(self, transactions):
+        """Fold newly saved transaction dicts into the totals"""
+        for t in transactions:
+            try:
+                month = datetime.strptime(str(t['Date']), "%Y-%m-%d").strftime("%Y-%m")
+            except (KeyError, ValueError):
+                continue
+            try:
+                cents = int(round(float(t['Amount']) * 100))
+            except (TypeError, ValueError):
+                cents = 0
+            cell = self._cells.setdefault((month, t.get('Category') or "", t.get('Type') or ""), [0, 0])
+            cell[0] += cents
+            cell[1] += 1
+    
+    def cells(self, start_month=None, end_month=None):
+        """Yields (month, category, type, cents, count) over an inclusive month range"""
+        for (month, category, kind), (cents, count) in self._cells.items():
+            if (count and (start_month is None or month >= start_month)
+                    and (end_month is None or month <= end_month)):
+                yield month, category, kind, cents, count
+    
+    def _cells_for(self, transaction_type, start_month=None, end_month=None):
+        for month, category, kind, cents, count in self.cells(start_month, end_month):
+            if kind == transaction_type:
+                yield month, category, cents, count
+    
+    def total(self, transaction_type, start_month=None, end_month=None):
+        """Sum for one type over an inclusive "YYYY-MM" month range"""
+        return sum(cents for _, _, cents, _ in self._cells_for(transaction_type, start_month, end_month)) / 100
+    
+    def by_category(self, transaction_type, start_month=None, end_month=None):
+        """Returns: {category: amount} over an inclusive "YYYY-MM" month range"""
+        totals = defaultdict(int)
+        for _, category, cents, _ in self._cells_for(transaction_type, start_month, end_month):
+            totals[category] += cents
+        return {category: cents / 100 for category, cents in totals.items()}
+
+class DashboardSummary:
+    """
+    Everything the dashboard tabs show, computed in one pass over the rollup
+    cells of the history window: totals and counts per type, per-category
+    sums and per-month sums and counts. Built once per rerun and shared.
+    """
+    
+    def __init__(self, rollup, start_month=None, end_month=None):
+        totals = defaultdict(int)
+        counts = defaultdict(int)
+        by_category = defaultdict(lambda: defaultdict(int))
+        by_month = defaultdict(lambda: defaultdict(int))
+        month_counts = defaultdict(int)
+        
+        for month, category, kind, cents, count in rollup.cells(start_month, end_month):
+            totals[kind] += cents
+            counts[kind] += count
+            by_category[kind][category] += cents
+            by_month[month][kind] += cents
+            month_counts[month] += count
+        
+        self.totals = {kind: cents / 100 for kind, cents in totals.items()}
+        self.counts = dict(counts)
+        self.by_category = {kind: {cat: cents / 100 for cat, cents in cats.items()} for kind, cats in by_category.items()}
+        self.by_month = {month: {kind: cents / 100 for kind, cents in kinds.items()} for month, kinds in sorted(by_month.items())}
+        self.month_counts = dict(sorted(month_counts.items()))
+        self.count = sum(counts.values())
+    
+    @property
+    def total_spent(self):
+        return self.totals.get('Expense', 0.0)
+    
+    @property
+    def total_earned(self):
+        return self.totals.get('Income', 0.0)
+    
+    @property
+    def expense_by_category(self):
+        return self.by_category.get('Expense', {})
+
 # --- DATABASE FUNCTIONS ---
+@st.cache_resource
+def _user_id_cache():
+    """Process-wide username -> user id map shared by all sessions"""
+    return {}
+
 def get_or_create_user(username):
+    """
+    User id for a username (the username itself in demo mode). A new user is
+    created by the same single upsert that looks the id up, and ids are
+    cached for the life of the process, so repeat logins make no request.
+    Raises: Exception when the database request fails
+    """
+    if not USE_DATABASE:
+        return username
+    
+    user_ids = _user_id_cache()
+    if username not in user_ids:
+        # Not ignore_duplicates: the conflict update is what returns an existing row
+        result = supabase.table('users').upsert({'username': username}, on_conflict='username').execute()
+        if not result.data:
+            raise Exception(f"No user row returned for {username}")
+        user_ids[username] = result.data[0]['id']
+    return user_ids[username]
+
+def _user_data(user_id):
+    """Session-state storage for a user (the store used in demo mode)"""
+    if user_id not in st.session_state.all_user_data:
+        st.session_state.all_user_data[user_id] = {'transactions': TransactionStore(), 'budget': {}, 'goals': []}
+    return st.session_state.all_user_data[user_id]
+
+def transaction_fingerprint(user_id, transaction, ordinal=0):
+    """
+    Dedup key: user, card, date, amount in cents and normalized vendor, plus
+    an ordinal that tells identical purchases on the same day apart
+    """
+    try:
+        cents = int(round(float(transaction['Amount']) * 100))
+    except (KeyError, TypeError, ValueError):
+        cents = 0
+    key = "|".join([
+        str(user_id), str(transaction.get('Card') or ''), str(transaction.get('Date')), str(cents),
+        normalize_merchant(transaction.get('Vendor') or ''), str(ordinal)
+    ])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def _fingerprint_batch(user_id, transactions):
+    """
+    Fingerprints for a batch, numbering repeats of the same purchase 0, 1, 2...
+    so re-uploading a statement reproduces the same keys
+    """
+    occurrences = defaultdict(int)
+    fingerprints = []
+    for trans in transactions:
+        base = transaction_fingerprint(user_id, trans)
+        ordinal = occurrences[base]
+        occurrences[base] += 1
+        fingerprints.append(base if ordinal == 0 else transaction_fingerprint(user_id, trans, ordinal))
+    return fingerprints
+
+def _fingerprint_index(user_id):
+    """
+    Set of fingerprints already saved, for O(1) duplicate checks. In demo mode
+    it covers the whole session store; with the database it holds what this
+    session saved, and the unique index on (user_id, fingerprint) covers the rest.
+    """
+    data = _user_data(user_id)
+    if 'fingerprints' not in data:
+        data['fingerprints'] = set() if USE_DATABASE else set(_fingerprint_batch(user_id, data['transactions']))
+    return data['fingerprints']
+
+def _save_session_transactions(user_id, transactions):
+    """Keep transactions in session state (demo mode, or rows the database rejected)"""
+    data = _user_data(user_id)
+    data['transactions'].append(transactions)
+    if 'rollup' in data:
+        data['rollup'].add(transactions)
+
+def _transaction_row(user_id, transaction, fingerprint=None):
+    row = {
+        'user_id': user_id,
+        'date': transaction['Date'],
+        'vendor': transaction['Vendor'],
+        'amount': float(transaction['Amount']),
+        'category': transaction['Category'],
+        'type': transaction['Type'],
+        'notes': transaction.get('Notes', ''),
+        'card_name': transaction.get('Card', '')
+    }
+    if fingerprint:
+        row['fingerprint'] = fingerprint
+    return row
+
+def _insert_transaction_rows(rows):
+    """Insert rows, skipping any whose fingerprint is already stored. Returns: inserted rows"""
+    return supabase.table('transactions').upsert(
+        rows, on_conflict='user_id,fingerprint', ignore_duplicates=True
+    ).execute().data
+
+def _is_row_error(error):
+    """
+    True when PostgREST rejected the rows themselves (a 4xx with an invalid
+    value or constraint violation, SQLSTATE class 22 or 23), which retrying
+    smaller batches can isolate
+    """
+    return str(getattr(error, 'code', None) or '')[:2] in ('22', '23')
+
+def save_transactions_bulk(user_id, transactions, chunk_size=TRANSACTION_INSERT_CHUNK, batch_fingerprints=None):
+    """
+    Save many transactions with one insert per chunk instead of one per row.
+    Rows already saved (same fingerprint) are skipped: first against the
+    session's fingerprint index, then by the database's unique index.
+    batch_fingerprints: one per transaction, for callers that number repeats
+    per statement (see _fingerprint_batch); by default they are numbered
+    across the whole batch.
+    A chunk rejected for its data is split in half and retried until the bad
+    rows are found; on any other error (connection, server) the rest of the
+    batch is not sent. Rows the database does not take go to the
+    session-state store in one step.
+    Returns: {'inserted': int, 'duplicates': int, 'session_only': int, 'failed': [{'index', 'error'}]}
+    """
+    failed = []
+    session_only = []
+    saved_rows = []
+    inserted = 0
+    
+    fingerprints = _fingerprint_index(user_id)
+    if batch_fingerprints is None:
+        batch_fingerprints = _fingerprint_batch(user_id, transactions)
+    # Overlapping statements can carry the same row twice; keep the first
+    new_indexes = []
+    batch_seen = set()
+    for i, fingerprint in enumerate(batch_fingerprints):
+        if fingerprint not in fingerprints and fingerprint not in batch_seen:
+            batch_seen.add(fingerprint)
+            new_indexes.append(i)
+    duplicates = len(transactions) - len(new_indexes)
+    
     if USE_DATABASE:
-        try:
-            result = supabase.table('users').select('id').eq('username', username).execute()
-            if result.data:
-                return result.data[0]['id']
-            else:
-                result = supabase.table('users').insert({'username': username}).execute()
-                return result.data[0]['id']
-        except:
-            pass
-    return username
+        db_error = None
+        for start in range(0, len(new_indexes), chunk_size):
+            rows = []
+            for index in new_indexes[start:start + chunk_size]:
+                trans = transactions[index]
+                try:
+                    rows.append((index, trans, _transaction_row(user_id, trans, batch_fingerprints[index])))
+                except Exception as e:
+                    failed.append({'index': index, 'error': f"Invalid transaction: {e}"})
+                    session_only.append(trans)
+            
+            if not rows:
+                continue
+            
+            # Split batches rejected for their data in half until the bad rows are isolated
+            pending = [rows]
+            while pending:
+                batch = pending.pop()
+                if db_error:
+                    error = db_error
+                else:
+                    try:
+                        result_rows = _insert_transaction_rows([row for _, _, row in batch])
+                        saved_rows.extend(result_rows)
+                        inserted += len(result_rows)
+                        duplicates += len(batch) - len(result_rows)
+                        fingerprints.update(row['fingerprint'] for _, _, row in batch)
+                        continue
+                    except Exception as e:
+                        error = str(e)
+                        if _is_row_error(e):
+                            if len(batch) > 1:
+                                middle = len(batch) // 2
+                                pending.extend([batch[middle:], batch[:middle]])
+                                continue
+                        else:
+                            # The database itself is failing; don't try the remaining rows
+                            db_error = error
+                failed.extend({'index': index, 'error': error} for index, _, _ in batch)
+                session_only.extend(trans for _, trans, _ in batch)
+    else:
+        session_only = [transactions[i] for i in new_indexes]
+    
+    if session_only:
+        _save_session_transactions(user_id, session_only)
+        fingerprints.update(batch_fingerprints[i] for i in new_indexes)
+    
+    _cache_merge_saved_rows(user_id, saved_rows)
+    _cache_add_local_transactions(user_id, session_only)
+    _cache_add_rollup(user_id, [_transaction_from_row(row) for row in saved_rows] + session_only)
+    return {'inserted': inserted, 'duplicates': duplicates, 'session_only': len(session_only),
+            'failed': sorted(failed, key=lambda f: f['index'])}
+
+def _transaction_from_row(t):
+    return {'Date': t['date'], 'Vendor': t['vendor'], 'Amount': float(t['amount']),
+            'Category': t['category'], 'Type': t['type'], 'Notes': t['notes'],
+            'Card': t.get('card_name', '')}
+
+def _fetch_transaction_rows(user_id, start_date=None, end_date=None, page_size=TRANSACTION_PAGE_SIZE):
+    """
+    Fetch a user's raw transaction rows newest first, optionally limited to an
+    inclusive date range ("YYYY-MM-DD"). Only the columns the app uses are
+    selected, and results are paged with keyset pagination on (date, id).
+    """
+    rows = []
+    last_row = None
+    while True:
+        query = supabase.table('transactions').select(TRANSACTION_COLUMNS).eq('user_id', user_id)
+        if start_date:
+            query = query.gte('date', start_date)
+        if end_date:
+            query = query.lte('date', end_date)
+        if last_row:
+            query = query.or_(f"date.lt.{last_row['date']},and(date.eq.{last_row['date']},id.lt.{last_row['id']})")
+        result = query.order('date', desc=True).order('id', desc=True).limit(page_size).execute()
+        
+        rows.extend(result.data)
+        if len(result.data) < page_size:
+            return rows
+        last_row = result.data[-1]
 
-def save_transaction(user_id, transaction):
+def _fetch_transaction_changes(user_id, since, page_size=TRANSACTION_PAGE_SIZE):
+    """
+    Fetch rows inserted or updated at or after the `since` high-water mark.
+    Returns: list of raw rows, or None when there are too many changes for a delta
+    """
+    result = (supabase.table('transactions').select(TRANSACTION_COLUMNS)
+              .eq('user_id', user_id)
+              .gte(TRANSACTION_SYNC_COLUMN, since)
+              .order(TRANSACTION_SYNC_COLUMN)
+              .limit(page_size)
+              .execute())
+    if len(result.data) >= page_size:
+        return None
+    return result.data
+
+def save_user_budget(user_id, budget_dict):
+    """
+    Save budget amounts. Only categories that differ from the last loaded
+    budget are sent, in one upsert on the (user_id, category) key, so a save
+    costs one request and never leaves the user without a budget.
+    Categories missing from budget_dict keep their saved amounts.
+    """
     if USE_DATABASE:
         try:
-            data = {
-                'user_id': user_id,
-                'date': transaction['Date'],
-                'vendor': transaction['Vendor'],
-                'amount': float(transaction['Amount']),
-                'category': transaction['Category'],
-                'type': transaction['Type'],
-                'notes': transaction.get('Notes', ''),
-                'card_name': transaction.get('Card', '')
-            }
-            supabase.table('transactions').insert(data).execute()
+            cache = _user_cache(user_id)
+            previous = cache['budget']['value'] if cache.get('budget') else {}
+            changed = [
+                {'user_id': user_id, 'category': cat, 'amount': float(amt)}
+                for cat, amt in budget_dict.items() if previous.get(cat) != float(amt)
+            ]
+            if changed:
+                supabase.table('budgets').upsert(changed, on_conflict='user_id,category').execute()
+            cache['budget'] = {'loaded_at': time.time(), 'value': {**previous, **budget_dict}}
             return True
         except:
             pass
     
-    if user_id not in st.session_state.all_user_data:
-        st.session_state.all_user_data[user_id] = {'transactions': [], 'budget': {}, 'goals': []}
-    st.session_state.all_user_data[user_id]['transactions'].append(transaction)
+    _user_data(user_id)['budget'] = budget_dict
+    _user_cache(user_id)['budget'] = {'loaded_at': time.time(), 'value': dict(budget_dict)}
     return True
 
-def load_user_transactions(user_id):
+def _fetch_user_budget(user_id):
     if USE_DATABASE:
         try:
-            result = supabase.table('transactions').select('*').eq('user_id', user_id).order('date', desc=True).execute()
+            result = supabase.table('budgets').select('*').eq('user_id', user_id).execute()
             if result.data:
-                return [{'Date': t['date'], 'Vendor': t['vendor'], 'Amount': float(t['amount']), 
-                        'Category': t['category'], 'Type': t['type'], 'Notes': t['notes'], 
-                        'Card': t.get('card_name', '')} for t in result.data]
+                return {item['category']: float(item['amount']) for item in result.data}
         except:
             pass
-    return st.session_state.all_user_data.get(user_id, {}).get('transactions', [])
+    return _user_data(user_id)['budget']
 
-def save_user_budget(user_id, budget_dict):
+def save_merchant_categories(user_id, categories):
+    """
+    Save a user's merchant overrides (normalized merchant -> category).
+    They replace any earlier entry for the merchant.
+    categories: {merchant: category}
+    """
+    merchants = load_merchant_map(user_id)
+    categories = {m: c for m, c in categories.items() if m}
+    if not categories:
+        return True
+    entries = {m: {'category': c, 'source': 'user'} for m, c in categories.items()}
+    
     if USE_DATABASE:
         try:
-            supabase.table('budgets').delete().eq('user_id', user_id).execute()
-            data = [{'user_id': user_id, 'category': cat, 'amount': float(amt)} for cat, amt in budget_dict.items()]
-            supabase.table('budgets').insert(data).execute()
+            rows = [{'user_id': user_id, 'merchant': m, 'category': c, 'source': 'user'} for m, c in categories.items()]
+            supabase.table('merchant_categories').upsert(rows, on_conflict='user_id,merchant').execute()
+            merchants.update(entries)
             return True
         except:
             pass
     
-    if user_id not in st.session_state.all_user_data:
-        st.session_state.all_user_data[user_id] = {'transactions': [], 'budget': {}, 'goals': []}
-    st.session_state.all_user_data[user_id]['budget'] = budget_dict
+    _user_data(user_id).setdefault('merchants', {}).update(entries)
+    merchants.update(entries)
     return True
 
-def load_user_budget(user_id):
+def _fetch_merchant_map(user_id):
     if USE_DATABASE:
         try:
-            result = supabase.table('budgets').select('*').eq('user_id', user_id).execute()
-            if result.data:
-                return {item['category']: float(item['amount']) for item in result.data}
+            result = supabase.table('merchant_categories').select('merchant,category,source').eq('user_id', user_id).execute()
+            return {row['merchant']: {'category': row['category'], 'source': row['source']} for row in result.data}
         except:
             pass
-    return st.session_state.all_user_data.get(user_id, {}).get('budget', {})
+    return dict(_user_data(user_id).get('merchants', {}))
+
+def _fetch_user_rollup(user_id):
+    """
+    Monthly totals from the transaction_rollups table, which a trigger on
+    transactions keeps current (see README).
+    Returns: MonthlyRollup, or None if the table can't be read
+    """
+    try:
+        result = (supabase.table('transaction_rollups').select('month,category,type,total,count')
+                  .eq('user_id', user_id)
+                  .execute())
+        return MonthlyRollup.from_rows(result.data)
+    except:
+        return None
+
+# --- SESSION DATA CACHE ---
+# Streamlit reruns the whole script on every widget change. Loads are kept per
+# user in session state for DATA_CACHE_TTL seconds, and the save functions
+# update the cached copies in place (write-through), so reruns that change
+# nothing make no database round trips. Once stale, transactions are brought
+# up to date with a delta fetch on TRANSACTION_SYNC_COLUMN, not a full reload.
+def _user_cache(user_id):
+    return st.session_state.data_cache.setdefault(user_id, {})
+
+def _is_fresh(entry):
+    return entry is not None and time.time() - entry['loaded_at'] < DATA_CACHE_TTL
+
+def _in_range(date, date_range):
+    start_date, end_date = date_range
+    return (not start_date or date >= start_date) and (not end_date or date <= end_date)
+
+def _merge_transaction_rows(entry, rows, advance_cursor=True):
+    """
+    Upsert database rows into a local copy by id. Rows from a fetch also
+    advance its sync cursor; our own just-saved rows must not, or rows other
+    sessions committed with an earlier updated_at would fall behind it.
+    """
+    in_range = [row for row in rows if _in_range(row['date'], entry['range'])]
+    entry['store'].append([_transaction_from_row(row) for row in in_range], keys=[row['id'] for row in in_range])
+    # Rows updated to a date outside the loaded window
+    entry['store'].remove([row['id'] for row in rows if not _in_range(row['date'], entry['range'])])
+    
+    if advance_cursor:
+        for row in rows:
+            row_cursor = row.get(TRANSACTION_SYNC_COLUMN)
+            if row_cursor and (entry['cursor'] is None or row_cursor > entry['cursor']):
+                entry['cursor'] = row_cursor
+    entry['ordered'] = None
+
+def _add_local_transactions(entry, transactions):
+    """Add rows that only exist in session state (demo mode or failed inserts)"""
+    start_date, end_date = entry['range']
+    if isinstance(transactions, list):
+        local = TransactionStore.from_records(t for t in transactions if _in_range(t['Date'], entry['range']))
+    else:
+        local = transactions.select(transactions.mask(start=start_date, end=end_date))
+    
+    first_key = entry['next_local_key']
+    entry['next_local_key'] += len(local)
+    entry['store'].append_store(local, keys=[('local', k) for k in range(first_key, entry['next_local_key'])])
+    entry['ordered'] = None
+
+def _load_transaction_entry(user_id, start_date, end_date):
+    """Full load of the user's transactions in a date range into a new local copy"""
+    entry = {'range': (start_date, end_date), 'loaded_at': time.time(), 'cursor': None,
+             'store': TransactionStore(), 'ordered': None, 'next_local_key': 0}
+    
+    if USE_DATABASE:
+        try:
+            _merge_transaction_rows(entry, _fetch_transaction_rows(user_id, start_date, end_date))
+        except:
+            pass
+    
+    if not len(entry['store']):
+        _add_local_transactions(entry, _user_data(user_id)['transactions'])
+    return entry
+
+def _sync_transaction_entry(user_id, entry):
+    """
+    Bring a stale local copy up to date. With the database this fetches only
+    rows changed since the last high-water mark; a full reload happens only
+    when there is no cursor yet or the delta is too large.
+    """
+    if not USE_DATABASE or entry['cursor'] is None:
+        return _load_transaction_entry(user_id, *entry['range'])
+    
+    try:
+        changes = _fetch_transaction_changes(user_id, entry['cursor'])
+    except:
+        return entry
+    
+    if changes is None:
+        return _load_transaction_entry(user_id, *entry['range'])
+    
+    _merge_transaction_rows(entry, changes)
+    entry['loaded_at'] = time.time()
+    return entry
+
+def _cache_merge_saved_rows(user_id, rows):
+    entry = _user_cache(user_id).get('transactions')
+    if entry is not None and rows:
+        _merge_transaction_rows(entry, rows, advance_cursor=False)
+
+def _cache_add_local_transactions(user_id, transactions):
+    entry = _user_cache(user_id).get('transactions')
+    if entry is not None and transactions:
+        _add_local_transactions(entry, transactions)
+
+def load_user_transactions(user_id, start_date=None, end_date=None):
+    """
+    Load a user's transactions as a TransactionStore sorted newest first,
+    served from the session's local copy.
+    The copy is fully loaded once per date range and then kept current with
+    delta syncs every DATA_CACHE_TTL seconds.
+    """
+    cache = _user_cache(user_id)
+    entry = cache.get('transactions')
+    if entry is None or entry['range'] != (start_date, end_date):
+        entry = _load_transaction_entry(user_id, start_date, end_date)
+    elif not _is_fresh(entry):
+        entry = _sync_transaction_entry(user_id, entry)
+    cache['transactions'] = entry
+    
+    if entry['ordered'] is None:
+        entry['ordered'] = entry['store'].sorted_by_date()
+    return entry['ordered']
+
+def _cache_add_rollup(user_id, transactions):
+    entry = _user_cache(user_id).get('rollup')
+    if entry is not None and entry['value'] is not None and transactions:
+        entry['value'].add(transactions)
+
+def load_user_budget(user_id):
+    """Cached version of _fetch_user_budget"""
+    cache = _user_cache(user_id)
+    if not _is_fresh(cache.get('budget')):
+        cache['budget'] = {'loaded_at': time.time(), 'value': _fetch_user_budget(user_id)}
+    return cache['budget']['value']
+
+def load_merchant_map(user_id):
+    """Cached version of _fetch_merchant_map: {merchant: {'category', 'source'}}"""
+    cache = _user_cache(user_id)
+    if not _is_fresh(cache.get('merchants')):
+        cache['merchants'] = {'loaded_at': time.time(), 'value': _fetch_merchant_map(user_id)}
+    return cache['merchants']['value']
+
+def load_user_rollup(user_id, transactions=None):
+    """
+    Monthly totals for the dashboard. With the database this is the
+    transaction_rollups table, cached like the other loads; in demo mode it is
+    the session's own rollup. Both are updated on every save. If the table
+    can't be read, `transactions` (a TransactionStore) is rolled up instead;
+    that result covers only the loaded history window, so it is rebuilt on
+    each call rather than cached (only the failed read is remembered).
+    """
+    if not USE_DATABASE:
+        data = _user_data(user_id)
+        if 'rollup' not in data:
+            data['rollup'] = MonthlyRollup.from_store(data['transactions'])
+        return data['rollup']
+    
+    cache = _user_cache(user_id)
+    if not _is_fresh(cache.get('rollup')):
+        cache['rollup'] = {'loaded_at': time.time(), 'value': _fetch_user_rollup(user_id)}
+    if cache['rollup']['value'] is None:
+        return MonthlyRollup.from_store(transactions if transactions is not None else TransactionStore())
+    return cache['rollup']['value']
 
 # --- AZURE DOCUMENT INTELLIGENCE API ---
-def analyze_with_azure(pdf_bytes, filename):
+class _AzureRetry(Retry):
     """
-    Analyze PDF using Azure Document Intelligence
-    Returns structured transaction data
+    The analyze POST is not idempotent: it is retried only when Azure refused
+    it (429/503) or the connection failed before it was sent, never after a
+    5xx or a read error. Poll GETs are not retried on status here, so their
+    waits stay inside AzurePollSchedule's deadline.
+    """
+    def is_retry(self, method, status_code, has_retry_after=False):
+        return (method or "").upper() == "POST" and status_code in self.status_forcelist
+
+@st.cache_resource
+def get_azure_session(pool_size=AZURE_POOL_SIZE):
+    """
+    Shared HTTP session for Azure calls. Reuses keep-alive connections from a
+    pool and retries refused submissions with backoff (honoring Retry-After).
+    """
+    retry = _AzureRetry(
+        total=AZURE_MAX_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=AZURE_SUBMIT_RETRY_STATUSES,
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Ocp-Apim-Subscription-Key": AZURE_KEY})
+    return session
+
+class AzurePollSchedule:
+    """
+    Decides how long to wait between polls of an Azure operation.
+    Starts with short waits and backs off exponentially with jitter. Retry-After
+    is always honored as the minimum wait. The deadline scales with page count.
+    """
+    def __init__(self, page_count=1):
+        self.timeout = AZURE_TIMEOUT_BASE + AZURE_TIMEOUT_PER_PAGE * max(page_count or 1, 1)
+        self.deadline = time.monotonic() + self.timeout
+        self.attempt = 0
+    
+    def expired(self):
+        return time.monotonic() >= self.deadline
+    
+    def next_delay(self, retry_after=None):
+        backoff = min(AZURE_POLL_MAX, AZURE_POLL_INITIAL * (2 ** self.attempt))
+        self.attempt += 1
+        delay = random.uniform(backoff / 2, backoff)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return max(0.0, min(delay, self.deadline - time.monotonic()))
+
+def _parse_retry_after(value):
+    """Convert a Retry-After header (seconds or HTTP date) to seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def _count_pdf_pages(pdf_bytes):
+    try:
+        return len(PdfReader(BytesIO(pdf_bytes)).pages)
+    except Exception:
+        return 1
+
+def _submit_azure_analysis(pdf_bytes):
+    """
+    Upload a PDF to Azure Document Intelligence
+    Returns: (operation_location, retry_after_seconds)
     """
     if not AZURE_ENDPOINT or not AZURE_KEY:
         raise Exception("Azure credentials not configured in secrets")
     
     # Azure Document Intelligence endpoint
-    analyze_url = f"{AZURE_ENDPOINT}/formrecognizer/documentModels/prebuilt-invoice:analyze?api-version=2023-07-31"
-    
-    headers = {
-        "Content-Type": "application/pdf",
-        "Ocp-Apim-Subscription-Key": AZURE_KEY
-    }
+    analyze_url = f"{AZURE_ENDPOINT}/formrecognizer/documentModels/{AZURE_MODEL_ID}:analyze?api-version={AZURE_API_VERSION}"
     
     # Start analysis
-    response = requests.post(analyze_url, headers=headers, data=pdf_bytes)
+    response = get_azure_session().post(analyze_url, headers={"Content-Type": "application/pdf"}, data=pdf_bytes)
     
     if response.status_code != 202:
         raise Exception(f"Azure API Error {response.status_code}: {response.text}")
@@ -367,30 +1230,370 @@ def analyze_with_azure(pdf_bytes, filename):
     if not operation_location:
         raise Exception("No operation location in response")
     
-    # Poll for results (Azure processes async)
-    poll_headers = {"Ocp-Apim-Subscription-Key": AZURE_KEY}
+    return operation_location, _parse_retry_after(response.headers.get("Retry-After"))
+
+# Parts of an analyze response that extract_transactions_from_azure reads
+_AZURE_ITEM_PREFIX = "analyzeResult.documents.item.fields.Items.valueArray.item"
+_AZURE_LINE_PREFIX = "analyzeResult.pages.item.lines.item.content"
+_AZURE_LAYOUT_KEYS = frozenset(["boundingRegions", "spans", "polygon"])
+
+def iter_analyze_result(stream):
+    """
+    Incrementally parse an analyze response body (a binary file object) in
+    one pass. Yields ('status', str), ('error', message), ('document', None),
+    ('item', line item of the first document) and ('line', line text) as
+    they are found. Words, polygons and spans are skipped, never built.
+    """
+    builder = None
+    skip = None
+    documents = 0
     
-    for _ in range(60):  # Max 60 seconds
-        time.sleep(2)
-        poll_response = requests.get(operation_location, headers=poll_headers)
-        
-        if poll_response.status_code == 200:
-            result = poll_response.json()
-            status = result.get("status")
-            
-            if status == "succeeded":
-                return result
-            elif status == "failed":
-                raise Exception(f"Azure analysis failed: {result.get('error', {}).get('message', 'Unknown error')}")
-            # Status is "running" or "notStarted", continue polling
-        else:
-            raise Exception(f"Polling error {poll_response.status_code}")
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is not None:
+            if skip and (prefix == skip or prefix.startswith(skip + ".")):
+                continue
+            skip = None
+            if event == "map_key" and value in _AZURE_LAYOUT_KEYS:
+                skip = f"{prefix}.{value}"
+                continue
+            builder.event(event, value)
+            if event == "end_map" and prefix == _AZURE_ITEM_PREFIX:
+                yield "item", builder.value
+                builder = None
+        elif event == "string":
+            if prefix == _AZURE_LINE_PREFIX:
+                yield "line", value
+            elif prefix == "status":
+                yield "status", value
+            elif prefix == "error.message":
+                yield "error", value
+        elif event == "start_map":
+            if prefix == _AZURE_ITEM_PREFIX and documents == 1:
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif prefix == "analyzeResult.documents.item":
+                documents += 1
+                if documents == 1:
+                    yield "document", None
+
+def _slim_analyze_result(stream):
+    """
+    Stream-parse an analyze response into the subset that
+    extract_transactions_from_azure reads, so memory stays flat however many
+    pages the statement has. The slim result is also what gets cached.
+    """
+    result = {}
+    documents = []
+    items = []
+    lines = []
+    for kind, value in iter_analyze_result(stream):
+        if kind == "status":
+            result["status"] = value
+        elif kind == "error":
+            result["error"] = {"message": value}
+        elif kind == "document":
+            documents.append({"fields": {"Items": {"valueArray": items}}})
+        elif kind == "item":
+            items.append(value)
+        elif kind == "line":
+            lines.append({"content": value})
+    result["analyzeResult"] = {"documents": documents, "pages": [{"lines": lines}]}
+    return result
+
+def _read_poll_response(poll_response, stream=False):
+    """
+    Interpret one poll response; with stream=True the body is parsed
+    incrementally from poll_response.raw
+    Returns: (result or None, retry_after_seconds)
+    """
+    retry_after = _parse_retry_after(poll_response.headers.get("Retry-After"))
+    
+    if poll_response.status_code in AZURE_TRANSIENT_STATUSES:
+        return None, retry_after
+    if poll_response.status_code != 200:
+        raise Exception(f"Polling error {poll_response.status_code}")
     
-    raise Exception("Azure analysis timeout after 60 seconds")
+    if stream:
+        poll_response.raw.decode_content = True
+        result = _slim_analyze_result(poll_response.raw)
+    else:
+        result = poll_response.json()
+    status = result.get("status")
+    
+    if status == "succeeded":
+        return result, retry_after
+    elif status == "failed":
+        raise Exception(f"Azure analysis failed: {result.get('error', {}).get('message', 'Unknown error')}")
+    # Status is "running" or "notStarted", continue polling
+    return None, retry_after
+
+def _poll_once(session, operation_location):
+    """One poll request, streamed when ijson is available"""
+    if not IJSON_AVAILABLE:
+        return _read_poll_response(session.get(operation_location))
+    with session.get(operation_location, stream=True) as poll_response:
+        return _read_poll_response(poll_response, stream=True)
+
+def poll_azure_operation(operation_location, page_count=1, retry_after=None):
+    """Block until an Azure operation finishes and return its result"""
+    schedule = AzurePollSchedule(page_count)
+    session = get_azure_session()
+    
+    while not schedule.expired():
+        time.sleep(schedule.next_delay(retry_after))
+        result, retry_after = _poll_once(session, operation_location)
+        if result is not None:
+            return result
+    
+    raise Exception(f"Azure analysis timeout after {schedule.timeout} seconds")
 
-def extract_transactions_from_azure(azure_result):
+async def poll_azure_operation_async(operation_location, page_count=1, retry_after=None):
+    """Same as poll_azure_operation, but awaitable from asyncio"""
+    schedule = AzurePollSchedule(page_count)
+    session = get_azure_session()
+    
+    while not schedule.expired():
+        await asyncio.sleep(schedule.next_delay(retry_after))
+        result, retry_after = await asyncio.to_thread(_poll_once, session, operation_location)
+        if result is not None:
+            return result
+    
+    raise Exception(f"Azure analysis timeout after {schedule.timeout} seconds")
+
+def analyze_with_azure(pdf_bytes, filename, page_count=None, operation_location=None, on_submitted=None):
+    """
+    Analyze PDF using Azure Document Intelligence
+    operation_location: resume polling an operation submitted earlier
+    on_submitted(operation_location) is called as soon as a new analysis is accepted
+    Returns structured transaction data
+    """
+    cache_key = azure_cache_key(pdf_bytes)
+    cached = load_cached_azure_result(cache_key)
+    if cached is not None:
+        return cached
+    
+    if page_count is None:
+        page_count = _count_pdf_pages(pdf_bytes)
+    retry_after = None
+    if operation_location is None:
+        operation_location, retry_after = _submit_azure_analysis(pdf_bytes)
+        if on_submitted:
+            on_submitted(operation_location)
+    result = poll_azure_operation(operation_location, page_count, retry_after)
+    save_cached_azure_result(cache_key, result)
+    return result
+
+async def analyze_with_azure_async(pdf_bytes, filename, page_count=None):
+    """Awaitable version of analyze_with_azure"""
+    cache_key = azure_cache_key(pdf_bytes)
+    cached = await asyncio.to_thread(load_cached_azure_result, cache_key)
+    if cached is not None:
+        return cached
+    
+    if page_count is None:
+        page_count = _count_pdf_pages(pdf_bytes)
+    operation_location, retry_after = await asyncio.to_thread(_submit_azure_analysis, pdf_bytes)
+    result = await poll_azure_operation_async(operation_location, page_count, retry_after)
+    await asyncio.to_thread(save_cached_azure_result, cache_key, result)
+    return result
+
+# --- AZURE RESULT CACHE ---
+def azure_cache_key(pdf_bytes):
+    """Content hash of the PDF sent to Azure plus the model and API version"""
+    digest = hashlib.sha256(pdf_bytes)
+    digest.update(f"|{AZURE_MODEL_ID}|{AZURE_API_VERSION}".encode())
+    return digest.hexdigest()
+
+def _azure_cache_path(cache_key):
+    return os.path.join(AZURE_CACHE_DIR, f"{cache_key}.json")
+
+def load_cached_azure_result(cache_key):
+    """
+    Return a cached analyzeResult, or None if missing or older than the TTL.
+    A hit refreshes the file's mtime, which is what LRU eviction sorts on.
+    """
+    path = _azure_cache_path(cache_key)
+    try:
+        with open(path, "r") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if time.time() - entry.get('cached_at', 0) > AZURE_CACHE_TTL_DAYS * 86400:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return entry.get('result')
+
+def save_cached_azure_result(cache_key, result):
+    """Write a result atomically, then evict until the cache fits its size limit"""
+    try:
+        os.makedirs(AZURE_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=AZURE_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({'cached_at': time.time(), 'result': result}, f)
+        os.replace(tmp_path, _azure_cache_path(cache_key))
+    except OSError:
+        return
+    _evict_azure_cache()
+
+def _evict_azure_cache():
+    entries = []
+    total_bytes = 0
+    
+    with os.scandir(AZURE_CACHE_DIR) as it:
+        for entry in it:
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+    
+    max_bytes = AZURE_CACHE_MAX_MB * 1024 * 1024
+    expired_before = time.time() - AZURE_CACHE_TTL_DAYS * 86400
+    
+    # Oldest access first; entries untouched for longer than the TTL go regardless of size
+    for mtime, size, path in sorted(entries):
+        if total_bytes <= max_bytes and mtime >= expired_before:
+            break
+        try:
+            os.remove(path)
+            total_bytes -= size
+        except OSError:
+            pass
+
+# Currency amounts: "$1,234.56", "-12.00", "(45.00)", "12.00-", "45.00 CR", "45.00 DR".
+# Parentheses, a minus sign and CR mark negatives (credits).
+_AMOUNT_PATTERN = re.compile(
+    r"^\s*(?P<open>\()?\s*(?P<minus>-)?\s*\$?\s*(?P<number>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?|\.\d+)"
+    r"\s*\)?\s*(?P<suffix>CR|DR|-)?\s*$",
+    re.IGNORECASE
+)
+# The last amount with cents on a statement line (dates and store numbers have no cents)
+_LINE_AMOUNT_PATTERN = re.compile(
+    r".*?(?P<open>\()?(?P<minus>-)?\$?(?P<number>\d{1,3}(?:,\d{3})+\.\d{2}|\d+\.\d{2})\)?\s*(?P<suffix>CR|DR|-)?"
+    r"(?!.*\d\.\d{2})",
+    re.IGNORECASE
+)
+
+def parse_amounts(values, pattern=_AMOUNT_PATTERN):
+    """
+    Parse a batch of amount strings in one vectorized pass
+    Returns: float64 array, NaN where nothing parses
+    """
+    if not values:
+        return np.empty(0)
+    parts = pd.Series(values, dtype=object).astype(str).str.extract(pattern)
+    numbers = pd.to_numeric(parts['number'].str.replace(",", "", regex=False), errors='coerce').to_numpy(dtype=np.float64)
+    negative = (parts['open'].notna() | parts['minus'].notna() | parts['suffix'].str.upper().isin(["CR", "-"])).to_numpy()
+    return np.where(negative, -numbers, numbers)
+
+def _field_amounts(fields):
+    """
+    Amounts for Azure currency fields: the typed valueCurrency/valueNumber when
+    present, otherwise the content strings, parsed in one batch.
+    Returns: float64 array, 0.0 where nothing parses
+    """
+    amounts = np.zeros(len(fields))
+    untyped = []
+    for i, field in enumerate(fields):
+        typed = (field.get("valueCurrency") or {}).get("amount", field.get("valueNumber"))
+        if typed is not None:
+            amounts[i] = typed
+        else:
+            untyped.append(i)
+    if untyped:
+        amounts[untyped] = np.nan_to_num(parse_amounts([fields[i].get("content", "0") for i in untyped]), nan=0.0)
+    return amounts
+
+# Transaction dates: "01/15", "1/15/24", "01-15-2024", "2024-01-15", "Jan 15", "Jan 15, 2024".
+# Dates without a year take it from the statement period (see parse_dates).
+_DATE_BODY = (
+    r"(?:(?P<iso_year>\d{4})-(?P<iso_month>\d{1,2})-(?P<iso_day>\d{1,2})"
+    r"|(?P<month>\d{1,2})[/-](?P<day>\d{1,2})(?:[/-](?P<year>\d{4}|\d{2}))?"
+    r"|(?P<month_name>jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+(?P<name_day>\d{1,2})"
+    r"(?:,?\s+(?P<name_year>\d{4}))?)(?![\d/])"
+)
+_DATE_PATTERN = re.compile(r"(?<![\d/.-])" + _DATE_BODY, re.IGNORECASE)
+# Statement lines start with the transaction date
+_LINE_DATE_PATTERN = re.compile(r"^\s*" + _DATE_BODY, re.IGNORECASE)
+_PERIOD_PATTERN = re.compile(
+    r"statement period|billing period|billing cycle|closing date|statement date|period ending|statement ending",
+    re.IGNORECASE
+)
+_MONTH_NUMBERS = {name.lower(): number for number, name in enumerate(calendar.month_abbr) if name}
+
+def parse_dates(values, pattern=_DATE_PATTERN, period_end=None):
+    """
+    Parse a batch of date strings in one vectorized pass. A date without a
+    year falls in the year of period_end (the statement closing date), or the
+    year before when its month is later than the closing month. Without
+    period_end the latest date in the batch that has a year is used, then today.
+    Returns: list of "YYYY-MM-DD" strings, None where nothing parses
+    """
+    if not values:
+        return []
+    parts = pd.Series(values, dtype=object).astype(str).str.extract(pattern)
+    
+    def number(*columns):
+        combined = parts[columns[0]]
+        for column in columns[1:]:
+            combined = combined.fillna(parts[column])
+        return pd.to_numeric(combined, errors='coerce')
+    
+    month = number('iso_month', 'month').fillna(parts['month_name'].str.lower().str[:3].map(_MONTH_NUMBERS))
+    day = number('iso_day', 'day', 'name_day')
+    year = number('iso_year', 'year', 'name_year')
+    year = year.where(year.isna() | (year >= 100), year + 2000)
+    if period_end is None:
+        explicit = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': day}), errors='coerce').max()
+        period_end = datetime.now() if pd.isna(explicit) else explicit
+    inferred = period_end.year - (month > period_end.month).astype(int)
+    year = year.fillna(inferred)
+    
+    dates = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': day}), errors='coerce')
+    return [None if pd.isna(date) else date for date in dates.dt.strftime("%Y-%m-%d").tolist()]
+
+def find_statement_period(lines):
+    """
+    The statement period from header lines such as "Statement Period: 01/05/2024 - 02/04/2024"
+    or "Closing Date 02/04/24": dates with a year on the first such line.
+    Returns: (start, end) datetimes, start is None when only one date is given; None if not found
+    """
+    for line in lines:
+        if not _PERIOD_PATTERN.search(line):
+            continue
+        matches = [match for match in _DATE_PATTERN.finditer(line)
+                   if match.group('iso_year') or match.group('year') or match.group('name_year')]
+        dates = [datetime.strptime(date, "%Y-%m-%d") for date in parse_dates([m.group(0) for m in matches]) if date]
+        if dates:
+            return (min(dates) if len(dates) > 1 else None), max(dates)
+    return None
+
+def _item_date_text(item_fields):
+    """The date of an Azure line item: its typed valueDate, else the content string"""
+    field = item_fields.get("Date") or item_fields.get("TransactionDate") or {}
+    return field.get("valueDate") or field.get("content") or ""
+
+def extract_transactions_from_azure(azure_result, merchant_map=None, raise_errors=False):
     """
     Extract transactions from Azure Document Intelligence result
+    merchant_map: the user's merchant categories (see load_merchant_map)
+    raise_errors=True lets parse errors propagate instead of showing them
+    (for worker threads, where st.error goes nowhere)
+    Each transaction carries its own date; rows without one are bucketed
+    into the statement period (its closing date), or None if none is found.
+    Amounts keep their sign: credits and refunds are negative.
     Returns list of transaction dictionaries
     """
     transactions = []
@@ -399,21 +1602,32 @@ def extract_transactions_from_azure(azure_result):
         # Azure returns data in analyzeResult.documents[0].fields
         analyze_result = azure_result.get("analyzeResult", {})
         documents = analyze_result.get("documents", [])
+        pages = analyze_result.get("pages", [])
+        lines = [line.get("content", "") for page in pages for line in page.get("lines", [])]
+        
+        period = find_statement_period(lines)
+        period_end = period[1] if period else None
+        default_date = period_end.strftime("%Y-%m-%d") if period_end else None
         
         if not documents:
             # Try reading as generic document (line items)
-            pages = analyze_result.get("pages", [])
-            for page in pages:
-                lines = page.get("lines", [])
-                for line in lines:
-                    content = line.get("content", "")
-                    # Simple transaction detection
-                    if content and any(char.isdigit() for char in content):
-                        transactions.append({
-                            'description': content,
-                            'amount': 0.0,  # Will try to extract below
-                            'category': 'Other'
-                        })
+            # Only lines that start with a date and carry an amount are
+            # transactions; summary lines (balances, limits, minimum due) don't
+            lines = [content for content in lines if _LINE_DATE_PATTERN.match(content)]
+            amounts = parse_amounts(lines, _LINE_AMOUNT_PATTERN)
+            has_amount = ~np.isnan(amounts)
+            lines = [content for content, keep in zip(lines, has_amount) if keep]
+            amounts = amounts[has_amount].tolist()
+            dates = parse_dates(lines, _LINE_DATE_PATTERN, period_end)
+            categories = categorize_transactions(lines, merchant_map)
+            for content, amount, date, category in zip(lines, amounts, dates, categories):
+                if category != 'PAYMENT_EXCLUDE':
+                    transactions.append({
+                        'date': date or default_date,
+                        'description': content,
+                        'amount': amount,
+                        'category': category
+                    })
         else:
             # Extract from structured invoice/receipt format
             doc = documents[0]
@@ -421,12 +1635,12 @@ def extract_transactions_from_azure(azure_result):
             
             # Try to get line items
             items = fields.get("Items", {}).get("valueArray", [])
+            line_items = []
             
             for item in items:
                 item_fields = item.get("valueObject", {})
                 
                 description = ""
-                amount = 0.0
                 
                 # Try different field names Azure might use
                 desc_field = item_fields.get("Description") or item_fields.get("ProductName") or item_fields.get("Item")
@@ -434,145 +1648,768 @@ def extract_transactions_from_azure(azure_result):
                     description = desc_field.get("content", "Unknown")
                 
                 amount_field = item_fields.get("Amount") or item_fields.get("Total") or item_fields.get("Price")
-                if amount_field:
-                    try:
-                        amount = float(amount_field.get("content", "0").replace("$", "").replace(",", ""))
-                    except:
-                        amount = 0.0
                 
                 if description:
-                    category = categorize_transaction(description)
-                    if category != 'PAYMENT_EXCLUDE':
-                        transactions.append({
-                            'description': description,
-                            'amount': abs(amount),
-                            'category': category
-                        })
+                    line_items.append((description, amount_field or {}, _item_date_text(item_fields)))
+            
+            # Parse amounts and dates and categorize the whole statement in one batch each
+            amounts = _field_amounts([field for _, field, _ in line_items]).tolist()
+            dates = parse_dates([date for _, _, date in line_items], period_end=period_end)
+            categories = categorize_transactions([description for description, _, _ in line_items], merchant_map)
+            for (description, _, _), amount, date, category in zip(line_items, amounts, dates, categories):
+                if category != 'PAYMENT_EXCLUDE':
+                    transactions.append({
+                        'date': date or default_date,
+                        'description': description,
+                        'amount': amount,
+                        'category': category
+                    })
         
     except Exception as e:
+        if raise_errors:
+            raise
         st.error(f"Error extracting transactions: {str(e)}")
     
     return transactions
 
+# --- TRANSACTION CATEGORIZATION ---
+# Rules in priority order; the first rule that matches a description wins.
+# "keywords" match anywhere, "prefixes" at the start of the merchant name and
+# "regex" entries are regular expressions (all case-insensitive).
+# CATEGORY_RULES_FILE, when present, replaces these with a JSON list of the same shape.
+DEFAULT_CATEGORY_RULES = [
+    {"category": "PAYMENT_EXCLUDE", "keywords": ["payment thank you", "automatic payment", "online payment"]},
+    {"category": "Groceries", "keywords": ["costco whse", "walmart", "target", "vons", "sprouts", "trader joe", "whole foods", "aldi"]},
+    {"category": "Dining Out", "keywords": ["chipotle", "chick-fil-a", "shake shack", "starbucks", "mcdonald", "restaurant"]},
+    {"category": "Gas/Fuel", "keywords": ["gas", "fuel", "shell", "chevron"]},
+    {"category": "Entertainment", "keywords": ["netflix", "cinema", "movie"]},
+    {"category": "Home", "keywords": ["home depot", "lowes"]}
+]
+
+# Merchant normalization: "STARBUCKS #1234 SAN DIEGO CA" and "Starbucks #5678"
+# both become "starbucks", the key for memoized rules and each user's merchant map
+_US_STATES = (
+    "al ak az ar ca co ct de dc fl ga hi id il in ia ks ky la me md ma mi mn ms mo mt ne nv nh nj "
+    "nm ny nc nd oh ok or pa ri sc sd tn tx ut vt va wa wv wi wy"
+).split()
+_CARD_SUFFIX = re.compile(r"(?:x{2,}|\*{2,})\d{2,}")  # XXXX1234, ****1234
+_STORE_LOCATION = re.compile(r"\s(?:#|store\s*#?\s*|no\.\s*)\d+\b.*$")  # "#1234 SAN DIEGO CA" after the name
+_MERCHANT_NOISE = re.compile(r"#?\d{3,}")  # Terminal and reference numbers
+_STATE_SUFFIX = re.compile(r"\s(?:" + "|".join(_US_STATES) + r")$")
+
+def _rule_text(description):
+    """What the categorization rules see: the full description, lowercased, whitespace collapsed"""
+    return " ".join(str(description).lower().split())
+
+def normalize_merchant(description):
+    """
+    Merchant key for the user's merchant map: lowercase, drop card suffixes,
+    store numbers, locations and reference numbers. Rules are not matched on
+    this, since words after a store number can decide the category.
+    """
+    text = _CARD_SUFFIX.sub(" ", str(description).lower())
+    text = _STORE_LOCATION.sub("", text)
+    text = " ".join(_MERCHANT_NOISE.sub(" ", text).split())
+    return _STATE_SUFFIX.sub("", text)
+
+def _trie_pattern(node):
+    """Regex for the keywords in a character trie; "" marks the end of a keyword"""
+    branches = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    # Past the end of a keyword the longer ones are optional, tried first (greedy)
+    return "(?:" + body + ")?" if "" in node else body
+
+class CategoryMatcher:
+    """
+    Categorization rules compiled for batch matching. All keywords share one
+    regex built from a trie, so each position in a description costs one walk
+    down the trie no matter how many rules there are. The walk finds the
+    longest keyword starting there, and each keyword's priority already folds
+    in the shorter keywords it begins with. Prefix and regex rules go into a
+    second pattern with one capture group per rule (m.lastindex). The lowest
+    rule index matched wins, the same answer as checking the rules in order.
+    Rule results are memoized per description text.
+    """
+    
+    def __init__(self, rules, memo_size=CATEGORY_MEMO_SIZE):
+        self.load_error = None  # Why the configured rules weren't used, if they weren't
+        self._categories = [rule["category"] for rule in rules]
+        keyword_priority = {}
+        alternatives = []
+        self._group_priority = {}
+        group = 1
+        for priority, rule in enumerate(rules):
+            for keyword in rule.get("keywords", ()):
+                keyword = " ".join(keyword.lower().split())
+                if keyword:
+                    keyword_priority.setdefault(keyword, priority)
+            patterns = ["^" + re.escape(p.lower()) for p in rule.get("prefixes", ())]
+            patterns += [f"(?:{p})" for p in rule.get("regex", ())]
+            if patterns:
+                alternative = "(" + "|".join(patterns) + ")"
+                alternatives.append(alternative)
+                # m.lastindex is the outer group even when a rule's regex has groups of its own
+                self._group_priority[group] = priority
+                group += re.compile(alternative).groups
+        
+        trie = {}
+        for keyword in keyword_priority:
+            node = trie
+            for ch in keyword:
+                node = node.setdefault(ch, {})
+            node[""] = True
+        self._keyword_priority = {
+            keyword: min(keyword_priority.get(keyword[:end], priority) for end in range(1, len(keyword) + 1))
+            for keyword, priority in keyword_priority.items()
+        }
+        # Descriptions are normalized to lowercase, so only rule regexes need IGNORECASE
+        self._keyword_pattern = re.compile("(?=(" + _trie_pattern(trie) + "))") if trie else None
+        self._rule_pattern = re.compile("(?=" + "|".join(alternatives) + ")", re.IGNORECASE) if alternatives else None
+        self._memo = {}
+        self._memo_size = memo_size
+    
+    def match(self, text):
+        """Category for one description as returned by _rule_text"""
+        best = len(self._categories)
+        if self._keyword_pattern is not None:
+            for m in self._keyword_pattern.finditer(text):
+                best = min(best, self._keyword_priority[m.group(1)])
+        if self._rule_pattern is not None and best:
+            for m in self._rule_pattern.finditer(text):
+                best = min(best, self._group_priority[m.lastindex])
+        return self._categories[best] if best < len(self._categories) else "Other"
+    
+    def categorize(self, descriptions, merchant_map=None):
+        """
+        Returns: one category per description, each distinct text matched once.
+        merchant_map ({merchant: {'category', 'source'}}), keyed by
+        normalize_merchant: the user's own overrides (source 'user') are
+        checked before any rule. Older learned entries (source 'rule') are
+        not, so they can't pin a merchant to what the rules said back then.
+        """
+        merchant_map = merchant_map or {}
+        memo = self._memo
+        if len(memo) > self._memo_size:
+            memo.clear()
+        
+        results = []
+        for description in descriptions:
+            known = merchant_map.get(normalize_merchant(description)) if merchant_map else None
+            if known and known['source'] == 'user':
+                results.append(known['category'])
+                continue
+            text = _rule_text(description)
+            category = memo.get(text)
+            if category is None:
+                category = memo[text] = self.match(text)
+            results.append(category)
+        return results
+
+@st.cache_resource
+def _load_category_matcher(path, mtime):
+    """
+    Compile the rules file, or the built-in rules if there is none or it
+    can't be used. The reason is kept on the matcher as load_error.
+    """
+    load_error = None
+    if mtime is not None:
+        try:
+            with open(path) as f:
+                return CategoryMatcher(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError, re.error) as e:
+            load_error = f"{path}: {e}"
+            logger.error("Can't use category rules from %s, using the built-in rules: %s", path, e)
+    matcher = CategoryMatcher(DEFAULT_CATEGORY_RULES)
+    matcher.load_error = load_error
+    return matcher
+
+def get_category_matcher():
+    """Compiled rules, rebuilt only when the rules file changes"""
+    try:
+        mtime = os.path.getmtime(CATEGORY_RULES_FILE)
+    except OSError:
+        mtime = None
+    return _load_category_matcher(CATEGORY_RULES_FILE, mtime)
+
+def categorize_transactions(descriptions, merchant_map=None):
+    """Batch categorization; merchant_map is a user's map from load_merchant_map"""
+    return get_category_matcher().categorize(descriptions, merchant_map)
+
 def categorize_transaction(description):
-    desc_lower = description.lower()
-    if any(kw in desc_lower for kw in ['payment thank you', 'automatic payment', 'online payment']):
-        return 'PAYMENT_EXCLUDE'
-    if any(w in desc_lower for w in ['costco whse', 'walmart', 'target', 'vons', 'sprouts', 'trader joe', 'whole foods', 'aldi']):
-        return "Groceries"
-    elif any(w in desc_lower for w in ['chipotle', 'chick-fil-a', 'shake shack', 'starbucks', 'mcdonald', 'restaurant']):
-        return "Dining Out"
-    elif any(w in desc_lower for w in ['gas', 'fuel', 'shell', 'chevron']):
-        return "Gas/Fuel"
-    elif any(w in desc_lower for w in ['netflix', 'cinema', 'movie']):
-        return "Entertainment"
-    elif any(w in desc_lower for w in ['home depot', 'lowes']):
-        return "Home"
-    else:
-        return "Other"
+    return categorize_transactions([description])[0]
 
 # --- PDF PAGE DETECTION ---
-def find_transaction_pages(pdf_bytes):
+# Keywords that indicate transaction pages
+TRANSACTION_PAGE_KEYWORDS = (
+    "PURCHASES",
+    "TRANSACTIONS",
+    "PAYMENTS AND OTHER CREDITS",
+    "FEES CHARGED",
+    "TOTAL PURCHASES",
+    "BEGINNING BALANCE",
+    "ENDING BALANCE",
+    "ACCOUNT ACTIVITY"
+)
+
+# Keywords that indicate pages to skip
+SKIP_PAGE_KEYWORDS = (
+    "IMPORTANT DISCLOSURES",
+    "PRIVACY NOTICE",
+    "QUESTIONS?",
+    "CUSTOMER SERVICE",
+    "HOW TO CONTACT US",
+    "TERMS AND CONDITIONS",
+    "NOTICE TO CALIFORNIA RESIDENTS",
+    "INTEREST CHARGES",
+    "YOUR RIGHTS"
+)
+
+# Both keyword sets in one pattern. The zero-width lookahead reports a match at
+# every position, so overlapping keywords ("PRIVACY NOTICE TO CALIFORNIA
+# RESIDENTS") are all counted, exactly like separate substring checks.
+_PAGE_KEYWORD_PATTERN = re.compile(
+    "(?=(" + "|".join(re.escape(k) for k in sorted(TRANSACTION_PAGE_KEYWORDS + SKIP_PAGE_KEYWORDS, key=len, reverse=True)) + "))"
+)
+_SKIP_PAGE_KEYWORD_SET = frozenset(SKIP_PAGE_KEYWORDS)
+
+def score_page_text(text):
     """
-    Scan PDF to find pages with transactions, skip disclosure/info pages.
-    Returns: list of page numbers (0-indexed)
+    Count distinct transaction and skip keywords on a page in one pass
+    Returns: (transaction_count, skip_count)
+    """
+    found = {match.group(1) for match in _PAGE_KEYWORD_PATTERN.finditer(text.upper())}
+    skip_count = len(found & _SKIP_PAGE_KEYWORD_SET)
+    return len(found) - skip_count, skip_count
+
+@st.cache_resource
+def get_scan_pool(max_workers=SCAN_MAX_PROCESSES):
     """
+    Process-wide pool for page-text extraction, shared by every session and
+    statement job, so there are never more than SCAN_MAX_PROCESSES workers.
+    Workers start once from a forkserver on first use and are then reused.
+    Returns None where that start method isn't available.
+    """
+    mp_context = scan_context()
+    if mp_context is None:
+        return None
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context)
+
+def _extract_page_texts_parallel(pdf_bytes, page_numbers):
+    """
+    Split the pages across the shared worker pool. The PDF is copied once into
+    a shared-memory block that every worker parses in place.
+    """
+    workers = max(1, min(SCAN_MAX_PROCESSES, len(page_numbers) // 10))
+    chunk = -(-len(page_numbers) // (workers * 2))  # Two chunks per worker evens out slow pages
+    texts = {}
+    pool = get_scan_pool()
+    if pool is None:
+        raise RuntimeError("no process start method for the scan pool")
+    
+    shm = shared_memory.SharedMemory(create=True, size=len(pdf_bytes))
     try:
-        pdf = PdfReader(BytesIO(pdf_bytes))
-        transaction_pages = []
-        
-        # Keywords that indicate transaction pages
-        transaction_keywords = [
-            "PURCHASES",
-            "TRANSACTIONS", 
-            "PAYMENTS AND OTHER CREDITS",
-            "FEES CHARGED",
-            "TOTAL PURCHASES",
-            "BEGINNING BALANCE",
-            "ENDING BALANCE",
-            "ACCOUNT ACTIVITY"
-        ]
-        
-        # Keywords that indicate pages to skip
-        skip_keywords = [
-            "IMPORTANT DISCLOSURES",
-            "PRIVACY NOTICE",
-            "QUESTIONS?",
-            "CUSTOMER SERVICE",
-            "HOW TO CONTACT US",
-            "TERMS AND CONDITIONS",
-            "NOTICE TO CALIFORNIA RESIDENTS",
-            "INTEREST CHARGES",
-            "YOUR RIGHTS"
+        shm.buf[:len(pdf_bytes)] = pdf_bytes
+        futures = [
+            pool.submit(extract_page_range, shm.name, len(pdf_bytes), page_numbers[i:i + chunk])
+            for i in range(0, len(page_numbers), chunk)
         ]
+        for future in as_completed(futures):
+            texts.update(future.result())
+    except BrokenProcessPool:
+        # A worker died; start a fresh pool next time
+        get_scan_pool.clear()
+        raise
+    finally:
+        shm.close()
+        shm.unlink()
+    
+    return texts
+
+def extract_page_texts(pdf_bytes, page_numbers=None, reader=None):
+    """
+    Extract the text of the given pages (default: all).
+    Large jobs fan out to the scan pool; anything that goes wrong there is
+    logged and falls back to the single-process scan.
+    Returns: {page_number: text}, with None for unreadable pages
+    """
+    if reader is None:
+        reader = PdfReader(BytesIO(pdf_bytes))
+    if page_numbers is None:
+        page_numbers = list(range(len(reader.pages)))
+    
+    if len(page_numbers) >= PARALLEL_SCAN_MIN_PAGES and SCAN_MAX_PROCESSES > 1:
+        try:
+            return _extract_page_texts_parallel(pdf_bytes, page_numbers)
+        except Exception:
+            logger.warning("Parallel page scan failed; scanning %d pages in-process", len(page_numbers), exc_info=True)
+    
+    return {page_num: extract_text_safe(reader.pages[page_num]) for page_num in page_numbers}
+
+def _flatten_outline(reader, outline):
+    for item in outline:
+        if isinstance(item, list):
+            yield from _flatten_outline(reader, item)
+        else:
+            yield reader.get_destination_page_number(item), item.title or ""
+
+def classify_pages_from_outline(reader):
+    """
+    Keep whole sections from PDF bookmarks without extracting any text.
+    A bookmark covers pages up to the next bookmark; only sections whose titles
+    are clearly transactions are decided. A disclosure title isn't enough to
+    drop pages (a "Notices" section can run on into the activity), so those
+    are left to be scored on their text.
+    Returns: {page_number: score dict} for the pages to keep
+    """
+    try:
+        bookmarks = sorted(_flatten_outline(reader, reader.outline))
+    except Exception:
+        return {}
+    
+    # Merge titles that start on the same page
+    titles_by_page = OrderedDict()
+    for page_num, title in bookmarks:
+        titles_by_page[page_num] = f"{titles_by_page.get(page_num, '')} {title}"
+    
+    starts = list(titles_by_page)
+    page_count = len(reader.pages)
+    decided = {}
+    
+    for i, first in enumerate(starts):
+        transaction_count, skip_count = score_page_text(titles_by_page[first])
+        if transaction_count == 0 or skip_count > 0:
+            continue
         
-        st.info(f"📄 Scanning {len(pdf.pages)} pages for transactions...")
+        last = starts[i + 1] if i + 1 < len(starts) else page_count
+        for page_num in range(first, last):
+            decided[page_num] = {
+                'page': page_num,
+                'transaction_keywords': transaction_count,
+                'skip_keywords': skip_count,
+                'readable': True,
+                'keep': True,
+                'source': 'outline'
+            }
+    
+    return decided
+
+def _score_page(page_num, text):
+    readable = text is not None
+    transaction_count, skip_count = score_page_text(text) if readable else (0, 0)
+    
+    return {
+        'page': page_num,
+        'transaction_keywords': transaction_count,
+        'skip_keywords': skip_count,
+        'readable': readable,
+        # Keep page if it has transaction keywords and minimal skip keywords.
+        # If we can't read the page, include it to be safe.
+        'keep': not readable or (transaction_count > 0 and skip_count <= 1),
+        'source': 'text'
+    }
+
+@st.cache_resource
+def _page_scan_cache():
+    return {'lock': threading.Lock(), 'entries': OrderedDict()}
+
+class StatementDocument:
+    """
+    An uploaded statement PDF, parsed at most once. Page text is extracted
+    lazily and cached, and the filtered sub-PDF is built from the pages that
+    were already parsed instead of reading the file again.
+    """
+    def __init__(self, pdf_bytes):
+        self.pdf_bytes = pdf_bytes
+        self._reader = None
+        self._texts = {}
+        self._digest = None
+    
+    @property
+    def reader(self):
+        if self._reader is None:
+            self._reader = PdfReader(BytesIO(self.pdf_bytes))
+        return self._reader
+    
+    @property
+    def page_count(self):
+        return len(self.reader.pages)
+    
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.pdf_bytes).hexdigest()
+        return self._digest
+    
+    def page_texts(self, page_numbers):
+        """Returns: {page_number: text} for the requested pages, extracting only what is missing"""
+        missing = [page_num for page_num in page_numbers if page_num not in self._texts]
+        if missing:
+            self._texts.update(extract_page_texts(self.pdf_bytes, missing, self.reader))
+        return {page_num: self._texts[page_num] for page_num in page_numbers}
+    
+    def extract_pages(self, page_numbers):
+        """Returns: bytes of a new PDF holding only the given pages"""
+        writer = PdfWriter()
+        for page_num in page_numbers:
+            if page_num < self.page_count:
+                writer.add_page(self.reader.pages[page_num])
         
-        for page_num, page in enumerate(pdf.pages):
-            try:
-                text = page.extract_text().upper()
-                
-                # Skip if it's a disclosure/info page
-                skip_count = sum(1 for keyword in skip_keywords if keyword in text)
-                transaction_count = sum(1 for keyword in transaction_keywords if keyword in text)
-                
-                # Keep page if it has transaction keywords and minimal skip keywords
-                if transaction_count > 0 and skip_count <= 1:
-                    transaction_pages.append(page_num)
-                    st.success(f"✅ Page {page_num + 1}: Found transactions ({transaction_count} keywords)")
-                else:
-                    st.info(f"⏭️ Page {page_num + 1}: Skipping (likely disclosure/info page)")
-                    
-            except Exception as e:
-                # If we can't read the page, include it to be safe
-                st.warning(f"⚠️ Page {page_num + 1}: Could not scan, including anyway")
-                transaction_pages.append(page_num)
+        output = BytesIO()
+        writer.write(output)
+        return output.getvalue()
+
+def _as_document(pdf):
+    return pdf if isinstance(pdf, StatementDocument) else StatementDocument(pdf)
+
+def classify_pages(pdf, fast=True):
+    """
+    Score every page of a PDF (bytes or StatementDocument) without touching the UI.
+    fast=True keeps whole transaction sections from bookmarks where the PDF
+    has them; every other page is scored on its full text.
+    Results are cached per PDF hash, so re-scanning the same file is free.
+    Returns: list of {'page', 'transaction_keywords', 'skip_keywords', 'readable', 'keep', 'source'}
+    """
+    document = _as_document(pdf)
+    cache = _page_scan_cache()
+    cache_key = (document.digest, fast)
+    with cache['lock']:
+        if cache_key in cache['entries']:
+            cache['entries'].move_to_end(cache_key)
+            return cache['entries'][cache_key]
+    
+    decided = classify_pages_from_outline(document.reader) if fast else {}
+    pending = [page_num for page_num in range(document.page_count) if page_num not in decided]
+    texts = document.page_texts(pending)
+    
+    scores = [
+        decided[page_num] if page_num in decided else _score_page(page_num, texts[page_num])
+        for page_num in range(document.page_count)
+    ]
+    
+    with cache['lock']:
+        cache['entries'][cache_key] = scores
+        while len(cache['entries']) > PAGE_SCAN_CACHE_SIZE:
+            cache['entries'].popitem(last=False)
+    
+    return scores
+
+def find_transaction_pages(pdf, show_progress=True, fast=True):
+    """
+    Scan PDF (bytes or StatementDocument) to find pages with transactions,
+    skip disclosure/info pages.
+    Pass show_progress=False when running outside the script thread,
+    and fast=False to ignore bookmarks and score the text of every page.
+    Returns: list of page numbers (0-indexed)
+    """
+    try:
+        scores = classify_pages(pdf, fast)
+        transaction_pages = [score['page'] for score in scores if score['keep']]
         
         # If we didn't find any pages, return all pages (safe fallback)
         if not transaction_pages:
-            st.warning("⚠️ No transaction pages detected - processing all pages")
-            return list(range(len(pdf.pages)))
+            if show_progress:
+                st.warning("⚠️ No transaction pages detected - processing all pages")
+            return [score['page'] for score in scores]
+        
+        if show_progress:
+            unreadable = sum(1 for score in scores if not score['readable'])
+            st.info(
+                f"📄 Scanned {len(scores)} pages: keeping {len(transaction_pages)}, "
+                f"skipping {len(scores) - len(transaction_pages)} disclosure/info pages"
+                + (f" ({unreadable} unreadable pages included anyway)" if unreadable else "")
+            )
         
         return transaction_pages
         
     except Exception as e:
-        st.error(f"❌ PDF scan error: {str(e)}")
+        if show_progress:
+            st.error(f"❌ PDF scan error: {str(e)}")
         # Fallback: return None to process full PDF
         return None
 
-def extract_pages(pdf_bytes, page_numbers):
+def extract_pages(pdf, page_numbers):
     """
     Extract only specific pages into a new PDF
     Returns: bytes of the filtered PDF
     """
+    document = _as_document(pdf)
     try:
-        reader = PdfReader(BytesIO(pdf_bytes))
-        writer = PdfWriter()
-        
-        for page_num in page_numbers:
-            if page_num < len(reader.pages):
-                writer.add_page(reader.pages[page_num])
-        
-        output = BytesIO()
-        writer.write(output)
-        output.seek(0)
-        return output.getvalue()
+        return document.extract_pages(page_numbers)
         
     except Exception as e:
         st.error(f"❌ Page extraction error: {str(e)}")
         # Fallback: return original PDF
-        return pdf_bytes
+        return document.pdf_bytes
+
+# --- STATEMENT INGESTION PIPELINE ---
+def process_statement(pdf_bytes, filename, merchant_map=None, on_stage=None, operation_location=None, on_submitted=None):
+    """
+    Run scan -> split -> Azure -> parse for a single statement.
+    Makes no Streamlit calls, so it is safe to run on a worker thread
+    (merchant_map is loaded by the caller, not read from session state).
+    Split and parse errors are raised, not shown, so the caller can record them.
+    on_stage('ocr', transaction_pages) is called once the pages are known;
+    operation_location/on_submitted are passed to analyze_with_azure.
+    Returns: (transaction_pages, parsed_transactions)
+    """
+    document = StatementDocument(pdf_bytes)
+    transaction_pages = find_transaction_pages(document, show_progress=False)
+    
+    if transaction_pages:
+        filtered_pdf = document.extract_pages(transaction_pages)
+        page_count = len(transaction_pages)
+    else:
+        filtered_pdf = pdf_bytes
+        page_count = None
+    
+    if on_stage:
+        on_stage('ocr', transaction_pages)
+    result = analyze_with_azure(filtered_pdf, filename, page_count, operation_location, on_submitted)
+    return transaction_pages, extract_transactions_from_azure(result, merchant_map, raise_errors=True)
+
+def statement_transactions(parsed, account_name, default_date):
+    """
+    Turn parsed statement rows into transactions for saving. Rows keep the
+    date read from the statement; default_date ("YYYY-MM-DD", the month the
+    statement was uploaded for) only fills rows where none was found.
+    Negative amounts (credits and refunds) are saved as Income, so they
+    don't count as spending.
+    """
+    return [{
+        'Date': trans.get('date') or default_date,
+        'Vendor': trans['description'],
+        'Amount': abs(trans['amount']),
+        'Category': trans['category'],
+        'Type': 'Income' if trans['amount'] < 0 else 'Expense',
+        'Notes': f"From {account_name}",
+        'Card': account_name
+    } for trans in parsed]
+
+# --- STATEMENT JOB QUEUE ---
+# Each uploaded statement becomes a job in a SQLite table, run by a
+# process-wide worker pool: queued -> scanning -> ocr -> parsed -> saved (or
+# failed). Reruns and page refreshes only read job status. The Azure
+# Operation-Location is stored as soon as it is known, so after a restart
+# unfinished jobs resume polling instead of submitting the statement again.
+JOB_ACTIVE_STATES = ('queued', 'scanning', 'ocr')
+JOB_STATE_LABELS = {
+    'queued': "Waiting...",
+    'scanning': "Finding transaction pages...",
+    'ocr': "Reading with Azure AI...",
+    'parsed': "Ready",
+    'saved': "Added",
+    'failed': "Failed"
+}
+
+class StatementJobQueue:
+    """SQLite-backed statement jobs; PDFs are kept in job_dir until saved"""
+    
+    def __init__(self, job_dir=JOB_DIR, max_workers=INGEST_MAX_WORKERS):
+        os.makedirs(job_dir, exist_ok=True)
+        self._dir = job_dir
+        self._db_path = os.path.join(job_dir, "jobs.sqlite3")
+        self._lock = threading.Lock()
+        self._running = set()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="statement-job")
+        
+        self._execute("pragma journal_mode=wal")
+        self._execute("""
+            create table if not exists jobs (
+                id text primary key,
+                user_id text not null,
+                name text,
+                filename text,
+                pdf_path text,
+                state text not null,
+                pages text,
+                operation_location text,
+                transactions text,
+                error text,
+                created_at real,
+                updated_at real
+            )
+        """)
+        self._purge_expired()
+        
+        # Pick up jobs a previous process left unfinished
+        for job in self._query("select * from jobs where state in (?, ?, ?)", JOB_ACTIVE_STATES):
+            self._schedule(job['id'], None)
+    
+    # Storage
+    def _execute(self, sql, params=()):
+        with self._lock:
+            db = sqlite3.connect(self._db_path, timeout=30)
+            try:
+                with db:
+                    db.execute(sql, params)
+            finally:
+                db.close()
+    
+    def _query(self, sql, params=()):
+        db = sqlite3.connect(self._db_path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            return [self._job(row) for row in db.execute(sql, params)]
+        finally:
+            db.close()
+    
+    @staticmethod
+    def _job(row):
+        job = dict(row)
+        job['pages'] = json.loads(job['pages']) if job['pages'] else None
+        job['transactions'] = json.loads(job['transactions']) if job['transactions'] else []
+        return job
+    
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        self._execute(f"update jobs set {assignments} where id = ?", (*fields.values(), job_id))
+    
+    def _remove_pdf(self, job):
+        try:
+            os.remove(job['pdf_path'])
+        except (OSError, TypeError):
+            pass
+    
+    def _purge_expired(self):
+        cutoff = time.time() - JOB_RETENTION_DAYS * 86400
+        for job in self._query("select * from jobs where updated_at < ?", (cutoff,)):
+            self._remove_pdf(job)
+        self._execute("delete from jobs where updated_at < ?", (cutoff,))
+    
+    # Work
+    def _schedule(self, job_id, merchant_map):
+        with self._lock:
+            if job_id in self._running:
+                return
+            self._running.add(job_id)
+        self._pool.submit(self._run, job_id, merchant_map)
+    
+    def _run(self, job_id, merchant_map):
+        try:
+            job = self.get(job_id)
+            with open(job['pdf_path'], "rb") as f:
+                pdf_bytes = f.read()
+            self._update(job_id, state='scanning')
+            
+            def on_stage(state, pages):
+                self._update(job_id, state=state, pages=json.dumps(pages))
+            
+            def on_submitted(operation_location):
+                self._update(job_id, operation_location=operation_location)
+            
+            try:
+                pages, transactions = process_statement(
+                    pdf_bytes, job['filename'], merchant_map, on_stage,
+                    job['operation_location'], on_submitted
+                )
+            except Exception:
+                if not job['operation_location']:
+                    raise
+                # A resumed operation may have expired on Azure's side; submit once more
+                pages, transactions = process_statement(
+                    pdf_bytes, job['filename'], merchant_map, on_stage, None, on_submitted
+                )
+            self._update(job_id, state='parsed', pages=json.dumps(pages), transactions=json.dumps(transactions), error=None)
+        except Exception as e:
+            self._update(job_id, state='failed', error=str(e))
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+    
+    # Public API
+    def submit(self, user_id, name, filename, pdf_bytes, merchant_map=None):
+        """
+        Queue a statement and return its job id. The id comes from the user,
+        account name and file content, so submitting the same upload again
+        returns the existing job whatever its state; a failed job only runs
+        again through retry().
+        """
+        digest = hashlib.sha256(f"{user_id}|{name}|".encode())
+        digest.update(pdf_bytes)
+        job_id = digest.hexdigest()[:32]
+        
+        job = self.get(job_id)
+        if job is not None and job['state'] not in JOB_ACTIVE_STATES:
+            return job_id
+        
+        pdf_path = os.path.join(self._dir, f"{job_id}.pdf")
+        if not os.path.exists(pdf_path):
+            fd, tmp_path = tempfile.mkstemp(dir=self._dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(pdf_bytes)
+            os.replace(tmp_path, pdf_path)
+        
+        now = time.time()
+        if job is None:
+            self._execute(
+                "insert or ignore into jobs (id, user_id, name, filename, pdf_path, state, created_at, updated_at) "
+                "values (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, str(user_id), name, filename, pdf_path, now, now)
+            )
+        
+        self._schedule(job_id, merchant_map)
+        return job_id
+    
+    def retry(self, job_id, merchant_map=None):
+        """Run a failed job again from its saved PDF"""
+        job = self.get(job_id)
+        if job is None or job['state'] != 'failed':
+            return
+        self._update(job_id, state='queued', error=None, operation_location=None, created_at=time.time())
+        self._schedule(job_id, merchant_map)
+    
+    def get(self, job_id):
+        jobs = self._query("select * from jobs where id = ?", (job_id,))
+        return jobs[0] if jobs else None
+    
+    def status(self, job_ids):
+        """Jobs for the given ids, in the same order (unknown ids are left out)"""
+        if not job_ids:
+            return []
+        placeholders = ", ".join("?" for _ in job_ids)
+        jobs = {job['id']: job for job in self._query(f"select * from jobs where id in ({placeholders})", tuple(job_ids))}
+        return [jobs[job_id] for job_id in job_ids if job_id in jobs]
+    
+    def pending_jobs(self, user_id):
+        """A user's jobs that have not been saved yet, oldest first"""
+        return self._query(
+            "select * from jobs where user_id = ? and state != 'saved' order by created_at", (str(user_id),)
+        )
+    
+    def mark_saved(self, job_ids):
+        for job in self.status(job_ids):
+            self._update(job['id'], state='saved')
+            self._remove_pdf(job)
+    
+    def dismiss(self, job_id):
+        job = self.get(job_id)
+        if job is not None and job['state'] not in JOB_ACTIVE_STATES:
+            self._remove_pdf(job)
+            self._execute("delete from jobs where id = ?", (job_id,))
+
+@st.cache_resource
+def get_job_queue():
+    return StatementJobQueue()
 
 # --- SMART RECOMMENDATIONS ---
 def generate_recommendations(transactions, budget):
-    """Generate money-saving recommendations based on spending patterns"""
+    """
+    Generate money-saving recommendations based on spending patterns.
+    transactions: iterable of transaction dicts, or {category: amount} expense totals
+    """
     recommendations = []
     
     # Analyze spending by category
-    category_spending = defaultdict(float)
-    for t in transactions:
-        if t['Type'] == 'Expense':
-            category_spending[t['Category']] += t['Amount']
+    if isinstance(transactions, dict):
+        category_spending = defaultdict(float, transactions)
+    else:
+        category_spending = defaultdict(float)
+        for t in transactions:
+            if t['Type'] == 'Expense':
+                category_spending[t['Category']] += t['Amount']
     
     # Dining Out recommendations
     if category_spending.get('Dining Out', 0) > 300:
@@ -610,62 +2447,75 @@ def generate_recommendations(transactions, budget):
     return recommendations
 
 # --- ALERT SYSTEM ---
-def check_budget_alerts(transactions, budget):
-    """Check for budget alerts and warnings"""
+def check_budget_alerts(transactions, budget, today=None):
+    """
+    Check for budget alerts and warnings.
+    transactions: MonthlyRollup, DataFrame with typed Date/Category/Type/Amount
+    columns, or a TransactionStore
+    """
+    today = today or datetime.now()
     alerts = []
     
-    # Get current month spending
-    current_month = datetime.now().strftime("%Y-%m")
-    month_spending = defaultdict(float)
+    # Get current month spending per category
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    month_start = pd.Timestamp(today.year, today.month, 1)
+    month_end = month_start + pd.Timedelta(days=days_in_month)
     
-    for t in transactions:
-        if t['Type'] == 'Expense':
-            try:
-                trans_month = datetime.strptime(t['Date'], "%Y-%m-%d").strftime("%Y-%m")
-                if trans_month == current_month:
-                    month_spending[t['Category']] += t['Amount']
-            except:
-                pass
+    # Objects kept in session state outlive the rerun that defined their class,
+    # so the app's own types are told apart by interface, not isinstance
+    if hasattr(transactions, 'by_category'):
+        month = month_start.strftime("%Y-%m")
+        month_spending = pd.Series(transactions.by_category('Expense', start_month=month, end_month=month), dtype=float)
+    else:
+        frame = transactions if isinstance(transactions, pd.DataFrame) else transactions.to_frame()
+        if len(frame):
+            dates = pd.to_datetime(frame['Date'], errors='coerce')
+            in_month = (frame['Type'] == 'Expense') & (dates >= month_start) & (dates < month_end)
+            month_spending = frame.loc[in_month].groupby('Category', observed=True, sort=False)['Amount'].sum()
+        else:
+            month_spending = pd.Series(dtype=float)
+    
+    budget_amounts = pd.Series(budget, dtype=float)
+    budget_amounts = budget_amounts[budget_amounts > 0]
     
     # Check each budget category
-    for category, budget_amount in budget.items():
-        if budget_amount > 0:
-            spent = month_spending.get(category, 0)
-            percent = (spent / budget_amount) * 100
-            
-            if percent >= 100:
-                alerts.append({
-                    'level': 'danger',
-                    'category': category,
-                    'message': f"🔴 {category}: ${spent:,.0f}/${budget_amount:,.0f} ({percent:.0f}%) - OVER BUDGET!",
-                    'percent': percent
-                })
-            elif percent >= 80:
-                alerts.append({
-                    'level': 'warning',
-                    'category': category,
-                    'message': f"⚠️ {category}: ${spent:,.0f}/${budget_amount:,.0f} ({percent:.0f}%) - Getting close!",
-                    'percent': percent
-                })
+    spent = month_spending.reindex(budget_amounts.index, fill_value=0.0)
+    percent = spent / budget_amounts * 100
+    
+    for category in budget_amounts.index[percent >= 80]:
+        # Plain floats rather than numpy scalars, so alerts compare and serialize like any dict
+        spent_amount, budget_amount, pct = float(spent[category]), float(budget_amounts[category]), float(percent[category])
+        if pct >= 100:
+            alerts.append({
+                'level': 'danger',
+                'category': category,
+                'message': f"🔴 {category}: ${spent_amount:,.0f}/${budget_amount:,.0f} ({pct:.0f}%) - OVER BUDGET!",
+                'percent': pct
+            })
+        else:
+            alerts.append({
+                'level': 'warning',
+                'category': category,
+                'message': f"⚠️ {category}: ${spent_amount:,.0f}/${budget_amount:,.0f} ({pct:.0f}%) - Getting close!",
+                'percent': pct
+            })
     
     # Check if we're 2 weeks from month end
-    today = datetime.now()
-    days_left = calendar.monthrange(today.year, today.month)[1] - today.day
+    days_left = days_in_month - today.day
     
     if days_left <= 14:
         # Project month-end spending
-        days_elapsed = today.day
-        for category, spent in month_spending.items():
-            budget_amount = budget.get(category, 0)
-            if budget_amount > 0:
-                projected = (spent / days_elapsed) * calendar.monthrange(today.year, today.month)[1]
-                if projected > budget_amount * 1.1:  # Projected to be 10% over
-                    alerts.append({
-                        'level': 'warning',
-                        'category': category,
-                        'message': f"📊 {category}: Projected to overspend by ${projected - budget_amount:,.0f} this month",
-                        'percent': (projected / budget_amount) * 100
-                    })
+        budgeted_spending = month_spending[month_spending.index.isin(budget_amounts.index)]
+        category_budget = budget_amounts.reindex(budgeted_spending.index)
+        projected = budgeted_spending / today.day * days_in_month
+        
+        for category in projected.index[projected > category_budget * 1.1]:  # Projected to be 10% over
+            alerts.append({
+                'level': 'warning',
+                'category': category,
+                'message': f"📊 {category}: Projected to overspend by ${projected[category] - category_budget[category]:,.0f} this month",
+                'percent': (projected[category] / category_budget[category]) * 100
+            })
     
     return sorted(alerts, key=lambda x: x['percent'], reverse=True)
 
@@ -791,16 +2641,23 @@ def login_page():
                 elif password != MASTER_PASSWORD:
                     st.error("❌ Incorrect access code")
                 else:
-                    st.session_state.authenticated = True
-                    st.session_state.current_user = username
-                    st.session_state.user_id = get_or_create_user(username)
-                    
-                    if username not in st.session_state.onboarding_complete:
-                        st.session_state.onboarding_complete[username] = False
+                    try:
+                        user_id = get_or_create_user(username)
+                    except Exception as e:
+                        user_id = None
+                        st.error(f"❌ Could not sign in, the database is unavailable: {e}")
                     
-                    st.success(f"✅ Welcome, {username}!")
-                    time.sleep(0.5)
-                    st.rerun()
+                    if user_id is not None:
+                        st.session_state.authenticated = True
+                        st.session_state.current_user = username
+                        st.session_state.user_id = user_id
+                        
+                        if username not in st.session_state.onboarding_complete:
+                            st.session_state.onboarding_complete[username] = False
+                        
+                        st.success(f"✅ Welcome, {username}!")
+                        time.sleep(0.5)
+                        st.rerun()
         
         # Footer text
         st.markdown("""
@@ -821,6 +2678,12 @@ if not st.session_state.authenticated:
 current_user = st.session_state.current_user
 user_id = st.session_state.user_id
 
+# A broken rules file falls back to the built-in rules; say so once per session
+rules_error = get_category_matcher().load_error
+if rules_error and st.session_state.get('rules_error_shown') != rules_error:
+    st.session_state.rules_error_shown = rules_error
+    st.warning(f"⚠️ Category rules file could not be loaded, using the built-in rules instead. {rules_error}")
+
 if not st.session_state.onboarding_complete.get(current_user, False):
     # ONBOARDING WIZARD
     render_devin_logo("small")
@@ -1037,60 +2900,85 @@ if not st.session_state.onboarding_complete.get(current_user, False):
         month_names = [m['name'] for m in requested_months]
         st.info(f"📅 **Analyzing:** {', '.join(month_names)}")
         
-        with st.spinner("🤖 Processing your statements with AI..."):
-            all_transactions = []
+        # Collect every uploaded statement across the 3 months
+        statements = []
+        for month_idx in range(3):
+            accounts = st.session_state.onboarding_data.get(f'month_{month_idx}_accounts', [])
+            for account in accounts:
+                if account.get('file'):
+                    statements.append({
+                        'name': account['name'],
+                        'month': requested_months[month_idx]['date'].strftime("%Y-%m-%d") if month_idx < len(requested_months) else None,
+                        'file': account['file']
+                    })
+        
+        all_transactions = []
+        all_fingerprints = []
+        job_ids = []
+        analyzed_months = set()
+        
+        if statements:
+            # Each statement is submitted once as a background job; reruns only check on it
+            queue = get_job_queue()
+            statement_key = [(s['name'], s['file'].name, s['file'].size, s['month']) for s in statements]
+            submitted = st.session_state.onboarding_data.get('statement_jobs')
+            if submitted is None or submitted['key'] != statement_key:
+                merchant_map = load_merchant_map(user_id)
+                # Job id -> the month its statement was uploaded for (the same file twice is one job)
+                statement_months = {}
+                for statement in statements:
+                    job_id = queue.submit(user_id, statement['name'], statement['file'].name,
+                                          statement['file'].getvalue(), merchant_map)
+                    statement_months.setdefault(job_id, statement['month'])
+                submitted = {'key': statement_key, 'months': statement_months}
+                st.session_state.onboarding_data['statement_jobs'] = submitted
+            statement_months = submitted['months']
+            job_ids = list(statement_months)
+            jobs = queue.status(job_ids)
+            
+            # Failed jobs count as done; they only run again from their Retry button
+            done = sum(job['state'] not in JOB_ACTIVE_STATES for job in jobs)
+            st.progress(done / len(jobs), text=f"Processed {done} of {len(jobs)} statements")
+            for job in jobs:
+                if job['state'] == 'failed':
+                    st.error(f"❌ Error processing {job['name']}: {job['error']}")
+                    if st.button("🔄 Retry", key=f"retry_{job['id']}"):
+                        queue.retry(job['id'], load_merchant_map(user_id))
+                        st.rerun()
+                elif job['state'] in JOB_ACTIVE_STATES:
+                    st.info(f"⏳ {job['name']}: {JOB_STATE_LABELS[job['state']]}")
+                else:
+                    pages_note = f" from {len(job['pages'])} pages" if job['pages'] else ""
+                    st.success(
+                        f"✅ {job['name']}: Found {len(job['transactions'])} transactions{pages_note} "
+                        f"({job['updated_at'] - job['created_at']:.1f}s)"
+                    )
             
-            # Process all uploaded statements
-            for month_idx in range(3):
-                accounts = st.session_state.onboarding_data.get(f'month_{month_idx}_accounts', [])
-                for account in accounts:
-                    if account.get('file'):
-                        try:
-                            # STEP 1: Detect transaction pages
-                            pdf_bytes = account['file'].getvalue()
-                            
-                            st.markdown(f"### 📄 Processing: {account['name']}")
-                            transaction_pages = find_transaction_pages(pdf_bytes)
-                            
-                            # STEP 2: Extract only transaction pages
-                            if transaction_pages:
-                                filtered_pdf = extract_pages(pdf_bytes, transaction_pages)
-                                st.success(f"✅ Extracted {len(transaction_pages)} pages with transactions")
-                            else:
-                                filtered_pdf = pdf_bytes
-                                st.info("📄 Processing full document")
-                            
-                            # STEP 3: Send to Azure Document Intelligence
-                            result = analyze_with_azure(filtered_pdf, account['file'].name)
-                            
-                            # Extract transactions from Azure result
-                            parsed_transactions = extract_transactions_from_azure(result)
-                            
-                            st.info(f"🔍 Processing {account['name']}: Found {len(parsed_transactions)} transactions")
-                            
-                            for trans in parsed_transactions:
-                                all_transactions.append({
-                                    'Date': datetime.now().strftime("%Y-%m-%d"),
-                                    'Vendor': trans['description'],
-                                    'Amount': trans['amount'],
-                                    'Category': trans['category'],
-                                    'Type': 'Expense',
-                                    'Notes': f"From {account['name']}",
-                                    'Card': account['name']
-                                })
-                        except Exception as e:
-                            st.error(f"❌ Error processing {account['name']}: {str(e)}")
+            if done < len(jobs):
+                time.sleep(JOB_POLL_INTERVAL)
+                st.rerun()
+            
+            for job in jobs:
+                default_date = statement_months[job['id']] or datetime.now().strftime("%Y-%m-%d")
+                job_transactions = statement_transactions(job['transactions'], job['name'], default_date)
+                # Repeats are numbered within each statement, so a purchase that
+                # appears on two overlapping statements gets the same key on both
+                all_fingerprints.extend(_fingerprint_batch(user_id, job_transactions))
+                all_transactions.extend(job_transactions)
+                if job['state'] != 'failed':
+                    analyzed_months.add(statement_months[job['id']])
         
         # Show results
         st.success(f"✅ Analyzed {len(all_transactions)} transactions!")
         
-        # Calculate insights
-        total_spending = sum([t['Amount'] for t in all_transactions])
-        avg_monthly = total_spending / 3
-        
-        category_totals = defaultdict(float)
-        for t in all_transactions:
-            category_totals[t['Category']] += t['Amount']
+        # Calculate insights. Monthly averages are over the statement months
+        # analyzed, not the calendar months the dates touch: a 15th-to-14th
+        # statement spans two of those.
+        insights = DashboardSummary(MonthlyRollup.from_store(TransactionStore.from_records(all_transactions)))
+        months_covered = max(len(analyzed_months), 1)
+        total_spending = insights.total_spent
+        avg_monthly = total_spending / months_covered
+        category_totals = insights.expense_by_category
         
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -1102,14 +2990,19 @@ if not st.session_state.onboarding_complete.get(current_user, False):
         
         st.markdown("### 📊 Spending Breakdown")
         for cat, amount in sorted(category_totals.items(), key=lambda x: x[1], reverse=True):
-            monthly_avg = amount / 3
+            monthly_avg = amount / months_covered
             st.write(f"**{cat}:** ${monthly_avg:,.0f}/month")
         
         # Save transactions
         if st.button("🎉 Complete Setup & Start Tracking!", type="primary", use_container_width=True):
             # Save all transactions
-            for trans in all_transactions:
-                save_transaction(user_id, trans)
+            save_result = save_transactions_bulk(user_id, all_transactions, batch_fingerprints=all_fingerprints)
+            if save_result['failed']:
+                st.warning(f"⚠️ {len(save_result['failed'])} transactions could not be saved to the database and are kept for this session only")
+            if save_result['duplicates']:
+                st.info(f"🔁 Skipped {save_result['duplicates']} transactions that were already saved")
+            if job_ids:
+                get_job_queue().mark_saved(job_ids)
             
             # Mark onboarding complete
             st.session_state.onboarding_complete[current_user] = True
@@ -1122,7 +3015,6 @@ else:
     # ====== MAIN APP (after onboarding) ======
     
     # Load user data
-    transactions = load_user_transactions(user_id)
     saved_budget = load_user_budget(user_id)
     
     # Sidebar
@@ -1141,6 +3033,20 @@ else:
         
         st.divider()
         
+        # History window - only this range is loaded from the database
+        st.markdown("### 📅 History")
+        history_window = st.selectbox("Show transactions from", list(HISTORY_WINDOWS), index=1)
+        history_months = HISTORY_WINDOWS[history_window]
+        if history_months:
+            window_start = datetime.now().replace(day=1)
+            for _ in range(history_months - 1):
+                window_start = (window_start - timedelta(days=1)).replace(day=1)
+            history_start = window_start.strftime("%Y-%m-%d")
+        else:
+            history_start = None
+        
+        st.divider()
+        
         # Income
         st.markdown("### 💰 Income")
         total_income = st.number_input("Monthly Income", value=0, step=100)
@@ -1195,6 +3101,10 @@ else:
         else:
             st.success(f"Left: ${remaining:,.0f}")
     
+    transactions = load_user_transactions(user_id, start_date=history_start)
+    rollup = load_user_rollup(user_id, transactions)
+    history_month = history_start[:7] if history_start else None
+    
     # Main content
     render_devin_logo("small")
     st.markdown(f"# {current_user}'s Financial Dashboard")
@@ -1204,7 +3114,7 @@ else:
         st.info("✅ Your data is saved permanently!")
     
     # ===== ALERTS SECTION =====
-    alerts = check_budget_alerts(transactions, categories)
+    alerts = check_budget_alerts(rollup, categories)
     
     if alerts:
         st.markdown("## 🚨 Budget Alerts")
@@ -1226,8 +3136,10 @@ else:
     st.divider()
     
     # Metrics
-    total_spent = sum([t['Amount'] for t in transactions if t['Type'] == 'Expense'])
-    total_earned = sum([t['Amount'] for t in transactions if t['Type'] == 'Income'])
+    summary = DashboardSummary(rollup, start_month=history_month)
+    total_spent = summary.total_spent
+    total_earned = summary.total_earned
+    expense_totals = summary.expense_by_category
     net_savings = total_earned - total_spent
     
     col1, col2, col3, col4 = st.columns(4)
@@ -1238,7 +3150,7 @@ else:
     with col3:
         st.metric("📊 Net Savings", f"${net_savings:,.0f}")
     with col4:
-        st.metric("📝 Transactions", len(transactions))
+        st.metric("📝 Transactions", summary.count)
     
     st.divider()
     
@@ -1250,15 +3162,14 @@ else:
         st.markdown("### 📊 Spending Overview")
         
         if transactions:
-            df = pd.DataFrame(transactions)
-            expenses = df[df['Type'] == 'Expense']
+            df = transactions.to_frame()
             
-            if not expenses.empty:
+            if expense_totals:
                 col1, col2 = st.columns(2)
                 
                 with col1:
                     # Pie chart
-                    category_totals = expenses.groupby('Category')['Amount'].sum().reset_index()
+                    category_totals = pd.DataFrame({'Category': list(expense_totals), 'Amount': list(expense_totals.values())})
                     fig = px.pie(category_totals, values='Amount', names='Category', 
                                 title='Spending by Category', hole=0.4)
                     fig.update_layout(
@@ -1272,7 +3183,7 @@ else:
                     # Bar chart - Budget vs Actual
                     budget_data = []
                     for cat, budget_amt in categories.items():
-                        actual = expenses[expenses['Category'] == cat]['Amount'].sum() if cat in expenses['Category'].values else 0
+                        actual = expense_totals.get(cat, 0)
                         budget_data.append({
                             'Category': cat,
                             'Budgeted': budget_amt,
@@ -1292,9 +3203,49 @@ else:
                     )
                     st.plotly_chart(fig2, use_container_width=True)
                 
+                # Monthly trend
+                monthly_df = pd.DataFrame({
+                    'Month': list(summary.by_month),
+                    'Income': [kinds.get('Income', 0) for kinds in summary.by_month.values()],
+                    'Spent': [kinds.get('Expense', 0) for kinds in summary.by_month.values()],
+                    'Transactions': list(summary.month_counts.values())
+                })
+                fig3 = px.bar(monthly_df, x='Month', y=['Income', 'Spent'], barmode='group',
+                              hover_data=['Transactions'], title='Monthly Trend',
+                              color_discrete_sequence=['#FFB84D', '#2C3E50'])
+                fig3.update_layout(
+                    plot_bgcolor='white', 
+                    paper_bgcolor='white',
+                    font=dict(color='#1a2332')
+                )
+                st.plotly_chart(fig3, use_container_width=True)
+                
                 # Recent transactions
                 st.markdown("### 📋 Recent Transactions")
-                st.dataframe(df.head(10), use_container_width=True, hide_index=True)
+                st.dataframe(df.head(10), use_container_width=True, hide_index=True,
+                             column_config={"Date": st.column_config.DateColumn("Date")})
+                
+                # Merchant overrides - used for future statements before any rule
+                with st.expander("🏷️ Merchant Categories"):
+                    merchant_map = load_merchant_map(user_id)
+                    merchants = sorted({normalize_merchant(v) for v in transactions.levels('Vendor')} - {""})
+                    category_options = sorted(set(categories) | {'Other'})
+                    
+                    with st.form("merchant_override"):
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            merchant = st.selectbox("Merchant", merchants)
+                        with col2:
+                            merchant_category = st.selectbox("Category", category_options)
+                        
+                        if st.form_submit_button("💾 Save", use_container_width=True) and merchant:
+                            save_merchant_categories(user_id, {merchant: merchant_category})
+                            st.success(f"✅ {merchant} will be categorized as {merchant_category} in future statements")
+                    
+                    overrides = {m: e['category'] for m, e in merchant_map.items() if e['source'] == 'user'}
+                    if overrides:
+                        st.dataframe(pd.DataFrame({'Merchant': list(overrides), 'Category': list(overrides.values())}),
+                                     use_container_width=True, hide_index=True)
         else:
             st.info("No transactions yet! Upload a statement to get started.")
     
@@ -1303,7 +3254,7 @@ else:
         st.markdown("### 💡 Smart Money-Saving Recommendations")
         
         if transactions:
-            recommendations = generate_recommendations(transactions, categories)
+            recommendations = generate_recommendations(expense_totals, categories)
             
             if recommendations:
                 total_potential_savings = sum([r['potential_savings'] for r in recommendations])
@@ -1494,53 +3445,75 @@ else:
         account_name = st.text_input("Account Name", placeholder="e.g., Chase Sapphire")
         uploaded_file = st.file_uploader("Upload Statement", type=['pdf', 'png', 'jpg', 'jpeg'])
         
+        queue = get_job_queue()
         if uploaded_file and account_name:
+            upload_key = (account_name, uploaded_file.name, uploaded_file.size)
             if st.button("🤖 Analyze & Add Transactions", type="primary"):
-                try:
-                    with st.spinner("🔍 Processing..."):
-                        # STEP 1: Detect transaction pages
-                        pdf_bytes = uploaded_file.getvalue()
-                        
-                        st.markdown(f"### 📄 Processing: {account_name}")
-                        transaction_pages = find_transaction_pages(pdf_bytes)
-                        
-                        # STEP 2: Extract only transaction pages
-                        if transaction_pages:
-                            filtered_pdf = extract_pages(pdf_bytes, transaction_pages)
-                            st.success(f"✅ Extracted {len(transaction_pages)} pages with transactions")
-                        else:
-                            filtered_pdf = pdf_bytes
-                            st.info("📄 Processing full document")
-                        
-                        # STEP 3: Send to Azure Document Intelligence
-                        result = analyze_with_azure(filtered_pdf, uploaded_file.name)
-                        
-                        # Extract transactions from Azure result
-                        parsed = extract_transactions_from_azure(result)
-                        
-                        st.success(f"✅ Found {len(parsed)} transactions!")
-                        
-                        if parsed:
-                            df_preview = pd.DataFrame(parsed)
-                            st.dataframe(df_preview.head(20), use_container_width=True, hide_index=True)
-                            
-                            if st.button(f"💾 Add All {len(parsed)} Transactions", type="primary"):
-                                for trans in parsed:
-                                    transaction = {
-                                        "Date": datetime.now().strftime("%Y-%m-%d"),
-                                        "Vendor": trans['description'],
-                                        "Amount": trans['amount'],
-                                        "Category": trans['category'],
-                                        "Type": "Expense",
-                                        "Notes": f"From {account_name}",
-                                        "Card": account_name
-                                    }
-                                    save_transaction(user_id, transaction)
-                                
-                                st.success("🎉 Added!")
-                                st.balloons()
-                                time.sleep(2)
-                                st.rerun()
+                job_id = queue.submit(user_id, account_name, uploaded_file.name, uploaded_file.getvalue(), load_merchant_map(user_id))
+                # The same upload again returns its earlier job, which may already be saved
+                if queue.get(job_id)['state'] == 'saved':
+                    st.session_state.saved_upload = {'key': upload_key, 'job_id': job_id}
+            
+            saved_upload = st.session_state.get('saved_upload')
+            if saved_upload and saved_upload['key'] == upload_key:
+                st.info("ℹ️ This statement was already added. Analyzing it again only adds transactions that aren't saved yet.")
+                if st.button("🔄 Analyze Again", key="reanalyze_upload"):
+                    queue.dismiss(saved_upload['job_id'])
+                    queue.submit(user_id, account_name, uploaded_file.name, uploaded_file.getvalue(), load_merchant_map(user_id))
+                    del st.session_state.saved_upload
+                    st.rerun()
+        
+        # Statements analyzed in the background; this only reads their status
+        upload_jobs = queue.pending_jobs(user_id)
+        for job in upload_jobs:
+            st.markdown(f"### 📄 {job['name']}")
+            
+            if job['state'] in JOB_ACTIVE_STATES:
+                st.info(f"⏳ {JOB_STATE_LABELS[job['state']]}")
+            elif job['state'] == 'failed':
+                st.error(f"❌ Error: {job['error']}")
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("🔄 Retry", key=f"retry_{job['id']}"):
+                        queue.retry(job['id'], load_merchant_map(user_id))
+                        st.rerun()
+                with col2:
+                    if st.button("🗑️ Dismiss", key=f"dismiss_{job['id']}"):
+                        queue.dismiss(job['id'])
+                        st.rerun()
+            else:
+                parsed = job['transactions']
+                if job['pages']:
+                    st.success(f"✅ Extracted {len(job['pages'])} pages with transactions")
+                st.success(f"✅ Found {len(parsed)} transactions!")
                 
-                except Exception as e:
-                    st.error(f"❌ Error: {str(e)}")
+                if parsed:
+                    df_preview = pd.DataFrame(parsed)
+                    st.dataframe(df_preview.head(20), use_container_width=True, hide_index=True)
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    add_clicked = st.button(f"💾 Add All {len(parsed)} Transactions", type="primary", key=f"add_{job['id']}",
+                                            disabled=not parsed)
+                with col2:
+                    if st.button("🗑️ Discard", key=f"dismiss_{job['id']}"):
+                        queue.dismiss(job['id'])
+                        st.rerun()
+                
+                if add_clicked:
+                    new_transactions = statement_transactions(parsed, job['name'], datetime.now().strftime("%Y-%m-%d"))
+                    save_result = save_transactions_bulk(user_id, new_transactions)
+                    if save_result['failed']:
+                        st.warning(f"⚠️ {len(save_result['failed'])} transactions could not be saved to the database and are kept for this session only")
+                    if save_result['duplicates']:
+                        st.info(f"🔁 Skipped {save_result['duplicates']} transactions that were already added")
+                    queue.mark_saved([job['id']])
+                    
+                    st.success("🎉 Added!")
+                    st.balloons()
+                    time.sleep(2)
+                    st.rerun()
+        
+        if any(job['state'] in JOB_ACTIVE_STATES for job in upload_jobs):
+            time.sleep(JOB_POLL_INTERVAL)
+            st.rerun()
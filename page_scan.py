@@ -0,0 +1,110 @@
+"""
+Process-pool side of the PDF page scan.
+
+The workers live in their own module so they pickle by an importable name:
+Streamlit runs the app as a fresh ``__main__`` on every rerun, and a worker
+defined there can't be found again once the script has rerun.
+"""
+import io
+import os
+import multiprocessing
+from multiprocessing import context, forkserver, popen_forkserver, reduction, shared_memory, spawn, util
+from multiprocessing.context import set_spawning_popen
+
+from PyPDF2 import PdfReader
+
+
+class _SharedBytesReader(io.RawIOBase):
+    """Read-only file object over a memoryview, so PdfReader can parse shared memory in place"""
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = max(0, min(len(buffer), len(self._view) - self._pos))
+        buffer[:size] = self._view[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+def extract_text_safe(page):
+    try:
+        return page.extract_text() or ""
+    except Exception:
+        return None
+
+def extract_page_range(shm_name, size, page_numbers):
+    """Process-pool worker: extract text for the given pages of the shared PDF"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    view = shm.buf[:size]
+    try:
+        reader = PdfReader(io.BufferedReader(_SharedBytesReader(view)))
+        texts = {page_num: extract_text_safe(reader.pages[page_num]) for page_num in page_numbers}
+        del reader
+        return texts
+    finally:
+        view.release()
+        shm.close()
+
+
+class _ScanPopen(popen_forkserver.Popen):
+    """
+    Forkserver launch without the parent's ``__main__``. multiprocessing
+    normally re-runs the main script in every new worker; under Streamlit
+    that is the whole app (secrets, session, UI), and the workers only need
+    this module.
+    """
+    def _launch(self, process_obj):
+        prep_data = spawn.get_preparation_data(process_obj._name)
+        prep_data.pop('init_main_from_path', None)
+        prep_data.pop('init_main_from_name', None)
+        buf = io.BytesIO()
+        set_spawning_popen(self)
+        try:
+            reduction.dump(prep_data, buf)
+            reduction.dump(process_obj, buf)
+        finally:
+            set_spawning_popen(None)
+
+        self.sentinel, w = forkserver.connect_to_new_process(self._fds)
+        _parent_w = os.dup(w)
+        self.finalizer = util.Finalize(self, util.close_fds, (_parent_w, self.sentinel))
+        with open(w, 'wb', closefd=True) as f:
+            f.write(buf.getbuffer())
+        self.pid = forkserver.read_signed(self.sentinel)
+
+class _ScanProcess(context.ForkServerProcess):
+    @staticmethod
+    def _Popen(process_obj):
+        return _ScanPopen(process_obj)
+
+class _ScanContext(context.ForkServerContext):
+    Process = _ScanProcess
+
+def scan_context():
+    """
+    multiprocessing context for the scan pool, or None where forkserver isn't
+    available. Workers start from a clean forkserver (which has this module
+    and PyPDF2 loaded) rather than forking the multi-threaded server.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return None
+    ctx = _ScanContext()
+    ctx.set_forkserver_preload([__name__])
+    return ctx